@@ -1,110 +1,173 @@
-import akshare as ak
-import pandas as pd
-from datetime import datetime
-from clickhouse_driver import Client
-
-# 连接 ClickHouse
-print("正在连接 ClickHouse...")
-client = Client(
-    host='...', 
-    user='...', 
-    password='', 
-    database='stock_data',
-    settings={'use_numpy': True} 
-)
+from datetime import datetime, time as dtime
+from pathlib import Path
+import os
+import sys
+import time
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ch_writer import BufferedInserter
+from infra.spot_cache import get_spot_snapshot
+from infra.db import execute, get_ch_client, insert_dataframe
+
+# 写入 stock_daily 的列顺序
+DAILY_COLUMNS = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
+
+# 盘中快照录制配置: 轮询间隔 (秒) 与批量写入的最长缓冲时间
+RECORD_INTERVAL = float(os.getenv("SPOT_RECORD_INTERVAL", "30"))
+RECORD_FLUSH_SECONDS = float(os.getenv("SPOT_RECORD_FLUSH_SECONDS", "120"))
+TRADING_SESSIONS = [(dtime(9, 15), dtime(11, 30)), (dtime(13, 0), dtime(15, 0))]
+
+INTRADAY_TABLE = 'stock_spot_intraday'
+INTRADAY_COLUMNS = ['ts_code', 'ts', 'price', 'vol', 'amount', 'turnover_rate', 'amplitude', 'volume_ratio']
+# 这些字段都没变的股票视为无更新, 不重复入库
+INTRADAY_VALUE_COLUMNS = ['price', 'vol', 'amount', 'turnover_rate', 'amplitude', 'volume_ratio']
 
 def get_realtime_daily_data():
-    print("正在通过 AKShare 从东方财富抓取全市场实时行情...")
+    print("正在获取全市场实时行情 (东方财富快照, 走本地缓存)...")
     try:
-        # 这个接口返回的列包含：代码,名称,最新价,涨跌幅,涨跌额,成交量,成交额,振幅,最高,最低,今开,昨收,量比,换手率,市盈率-动态,市净率...
-        df = ak.stock_zh_a_spot_em()
+        # 统一列名后的快照, 包含 ts_code, price, open, high, low, pre_close, change, pct_chg, vol, amount, turnover_rate...
+        df = get_spot_snapshot()
     except Exception as e:
         print(f"网络请求失败: {e}")
         return None
 
-    if df is None or df.empty:
-        print("未获取到数据")
-        return None
-
     # 时间处理
     today = datetime.now().date()
     
-    # 检查重复
+    # stock_daily 是 ReplacingMergeTree (见 infra/schema.py): 当天重复运行会以新版本覆盖, 不会产生重复行
     check_sql = f"SELECT count() FROM stock_daily WHERE trade_date = '{today}'"
     try:
-        count = client.execute(check_sql)[0][0]
+        count = execute(check_sql)[0][0]
         if count > 0:
-            print(f"今日 ({today}) 的行情数据已经存在 ({count} 条)! 跳过入库, 防止重复.")
-            return None 
+            print(f"今日 ({today}) 的行情数据已经存在 ({count} 条), 将以最新快照覆盖.")
     except Exception as e:
         print(f"检查重复失败: {e}")
 
     print(f"抓取成功! 原始数据 {len(df)} 行")
     
-    # 映射
-    rename_dict = {
-        '代码': 'ts_code',
-        '最新价': 'close',
-        '今开': 'open',
-        '最高': 'high',
-        '最低': 'low',
-        '昨收': 'pre_close',
-        '涨跌额': 'change',
-        '涨跌幅': 'pct_chg',
-        '成交量': 'vol',
-        '成交额': 'amount',
-        '换手率': 'turnover_rate'
-    }
-    
-    # 过滤掉不在 rename_dict 里的列，防止报错
-    available_cols = set(df.columns)
-    rename_keys = set(rename_dict.keys())
-    
-    cols_to_use = list(rename_keys.intersection(available_cols)) # 有时候 AKShare 返回的列会变, 做个交集处理更安全, 确保我们只取存在的列.
-    
-    df = df[cols_to_use].rename(columns=rename_dict)
-    
+    df = df.rename(columns={'price': 'close'})
     df['trade_date'] = today
-    df['ts_code'] = df['ts_code'].astype(str)
     
-    # 数值转换列表
+    # 数值列缺失值补 0 (AKShare 的换手率是百分比, 3.5代表3.5%)
     numeric_cols = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
-    
-    for col in numeric_cols:
-        # AKShare 的换手率是百分比(3.5代表3.5%)
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+    df[numeric_cols] = df[numeric_cols].fillna(0.0)
 
-    # 写入数据库的列顺序
-    columns_to_db = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
-    
-    # 按照指定顺序排列
-    df_final = df[columns_to_db].copy()
+    # 按照写入数据库的列顺序排列
+    df_final = df[DAILY_COLUMNS].copy()
 
     return df_final
 
+def ensure_intraday_table():
+    execute(f"""
+    CREATE TABLE IF NOT EXISTS {INTRADAY_TABLE}
+    (
+        `ts_code` LowCardinality(String),
+        `ts` DateTime CODEC(DoubleDelta, ZSTD(1)),
+        `price` Float64,
+        `vol` Float64,
+        `amount` Float64,
+        `turnover_rate` Float64,
+        `amplitude` Float64,
+        `volume_ratio` Float64
+    )
+    ENGINE = MergeTree
+    PARTITION BY toYYYYMMDD(ts)
+    ORDER BY (ts_code, ts)
+    SETTINGS index_granularity = 8192
+    """)
+
+def in_trading_hours(now=None):
+    now = now or datetime.now()
+    if now.weekday() >= 5:
+        return False
+    t = now.time()
+    return any(start <= t <= end for start, end in TRADING_SESSIONS)
+
+def get_intraday_snapshot():
+    """
+    强制刷新一次全市场快照 (同时写回共享缓存, 其他消费者可以直接复用), 只保留盘中录制需要的精简列
+    """
+    df = get_spot_snapshot(refresh=True)
+    df[INTRADAY_VALUE_COLUMNS] = df[INTRADAY_VALUE_COLUMNS].fillna(0.0)
+    df['ts'] = datetime.now().replace(microsecond=0)
+    return df[INTRADAY_COLUMNS]
+
+def changed_rows(df, prev):
+    """
+    和上一次轮询比较, 返回新出现或任一数值字段发生变化的股票 (按列向量化比较).
+    prev 是上一轮以 ts_code 为索引的数值快照, 为 None 时全部视为变化.
+    """
+    if prev is None or prev.empty:
+        return df
+    cur = df.set_index('ts_code')[INTRADAY_VALUE_COLUMNS]
+    old = prev.reindex(cur.index)
+    mask = old.isna().any(axis=1) | (cur != old).any(axis=1)
+    return df[mask.to_numpy()]
+
+def record_intraday(interval=RECORD_INTERVAL, max_polls=None):
+    """
+    常驻录制模式: 交易时段内按 interval 轮询全市场快照, 只把有变化的行追加到 stock_spot_intraday.
+    收盘后 (15:00 之后) 自动退出; 非交易时段 (开盘前/午休) 等待.
+    """
+    ensure_intraday_table()
+    prev = None
+    polls = 0
+    print(f"盘中快照录制启动: 每 {interval} 秒轮询一次, 写入 {INTRADAY_TABLE}")
+
+    with BufferedInserter(get_ch_client(), INTRADAY_TABLE, INTRADAY_COLUMNS, max_seconds=RECORD_FLUSH_SECONDS) as writer:
+        while max_polls is None or polls < max_polls:
+            now = datetime.now()
+            if now.weekday() >= 5 or now.time() > TRADING_SESSIONS[-1][1]:
+                print("已收盘, 录制结束.")
+                break
+            if not in_trading_hours(now):
+                # 开盘前/午休期间不请求接口, 午休前把缓冲写掉
+                writer.flush()
+                time.sleep(interval)
+                continue
+
+            started = time.monotonic()
+            try:
+                df = get_intraday_snapshot()
+            except Exception as e:
+                print(f"[{now:%H:%M:%S}] 快照抓取失败: {e}")
+                df = None
+
+            if df is not None and not df.empty:
+                delta = changed_rows(df, prev)
+                writer.add(delta)
+                prev = df.set_index('ts_code')[INTRADAY_VALUE_COLUMNS]
+                print(f"[{now:%H:%M:%S}] 快照 {len(df)} 行, 变化 {len(delta)} 行, 累计写入 {writer.total_rows} 行")
+            polls += 1
+
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    print(f"录制完成: 共 {polls} 次轮询, {writer.flush_count} 次批量写入, {writer.total_rows} 行")
+
 def save_to_clickhouse(df):
     if df is None or df.empty:
         return
 
     print(f"正在写入 {len(df)} 条数据到 ClickHouse...")
     try:
-        # Insert
-        client.insert_dataframe(
-            'INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount, turnover_rate) VALUES',
-            df
-        )
+        insert_dataframe('stock_daily', df, DAILY_COLUMNS)
         print("入库成功!")
     except Exception as e:
         print(f"入库失败: {e}")
 
 if __name__ == "__main__":
+    # 盘中录制模式: python data_ingestion/fetch_akshare.py --record
+    if "--record" in sys.argv[1:]:
+        record_intraday()
+        sys.exit(0)
+
     data = get_realtime_daily_data()
     if data is not None:
         save_to_clickhouse(data)
         
         # 验证
         try:
-            count = client.execute("SELECT count() FROM stock_daily")[0][0]
+            count = execute("SELECT count() FROM stock_daily")[0][0]
             print(f"数据库当前总行数: {count}")
 
         except Exception as e:
@@ -1,75 +1,118 @@
-import akshare as ak
 import pandas as pd
-from clickhouse_driver import Client
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from pathlib import Path
+import os
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ak_replay import ak
+from infra.rate_limit import TokenBucket, retry_call
+from infra.db import execute, insert_dataframe
+
+# 存入数据库和 Qlib 用的代码 -> AkShare 接口用的代码
+BENCHMARKS = {
+    "SH000300": "sh000300",  # 沪深300
+    "SH000905": "sh000905",  # 中证500
+    "SH000852": "sh000852",  # 中证1000
+    "SZ399006": "sz399006",  # 创业板指
+    "SH000688": "sh000688",  # 科创50
+}
+# 需要更新的指数, 逗号分隔, 例如 BENCHMARK_CODES=SH000300,SH000905
+BENCHMARK_CODES = [c.strip().upper() for c in os.getenv("BENCHMARK_CODES", ",".join(BENCHMARKS)).split(",") if c.strip()]
+MAX_WORKERS = int(os.getenv("BENCHMARK_WORKERS", "5"))
+REQUEST_RATE = float(os.getenv("BENCHMARK_RATE", "2"))
+
+DAILY_COLUMNS = ['ts_code', 'trade_date', 'open', 'high', 'low', 'close',
+                 'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']
+
+def get_latest_dates(codes):
+    """一次查询所有指数已入库的最新日期, 返回 {ts_code: date}, 没有数据的指数不在结果里"""
+    if not codes:
+        return {}
+    code_list = ", ".join(f"'{c}'" for c in codes)
+    sql = f"SELECT ts_code, max(trade_date) FROM stock_daily WHERE ts_code IN ({code_list}) GROUP BY ts_code"
+    return {row[0]: row[1] for row in execute(sql)}
+
+def fetch_benchmark(target_code, since=None):
+    """
+    下载并清洗单个指数日K, 只返回 since 之后的新 bar (since 为 None 时返回全历史).
+    pre_close 基于完整历史计算, 所以增量部分的第一根 bar 也有正确的昨收.
+    """
+    df = ak.stock_zh_index_daily(symbol=BENCHMARKS[target_code])
+    if df is None or df.empty:
+        return None
+
+    # 数据清洗
+    df['trade_date'] = pd.to_datetime(df['date']).dt.date
+    df['ts_code'] = target_code
+    df = df.sort_values('trade_date').reset_index(drop=True)
 
-# Config
-CLICKHOUSE_HOST = '...'
-CLICKHOUSE_DB = 'stock_data'
-BENCHMARK_CODE = "sh000300"  # AkShare 接口用的代码
-TARGET_CODE = "SH000300"     # 存入数据库和 Qlib 用的代码
-
-def fetch_and_save_benchmark():
-    print(f"正在下载沪深300指数数据 ({BENCHMARK_CODE})...")
-    
-    # 1. 指数日K
-    try:
-        df = ak.stock_zh_index_daily(symbol=BENCHMARK_CODE)
-        print(f"获取成功！共 {len(df)} 条历史记录")
-    except Exception as e:
-        print(f"AkShare 下载失败: {e}")
-        return
-
-    # 2. 数据清洗
-    df['trade_date'] = pd.to_datetime(df['date'])
-    df['ts_code'] = TARGET_CODE 
-    
     # 统一字段名
-    if 'vol' not in df.columns and 'volume' in df.columns:
-        df = df.rename(columns={'volume': 'vol'})
-    elif 'vol' in df.columns:
-        pass # keep vol
-    
+    if 'vol' not in df.columns:
+        df['vol'] = df['volume'] if 'volume' in df.columns else 0
+
     # 补充 Qlib 所需 fields
     df['pre_close'] = df['close'].shift(1).fillna(df['open'])
     df['change'] = df['close'] - df['pre_close']
     df['pct_chg'] = df['change'] / df['pre_close'] * 100
-    
-    # 确保 volume 存在且格式正确
-    if 'vol' in df.columns:
-         df['volume'] = df['vol']
-    else:
-         df['volume'] = 0
-
     df['amount'] = 0.0
     df['turnover_rate'] = 0.0
 
-    # 3. 存入 ClickHouse
-    print(f"正在写入 ClickHouse 表 {CLICKHOUSE_DB}.stock_daily ...")
-    
-    # 添加 settings 参数, 解除分区写入限制
-    client = Client(
-        host=CLICKHOUSE_HOST, 
-        database=CLICKHOUSE_DB, 
-        settings={
-            'use_numpy': True,
-            'max_partitions_per_insert_block': 2000
+    if since is not None:
+        df = df[df['trade_date'] > since]
+    if df.empty:
+        return None
+    return df[DAILY_COLUMNS]
+
+def fetch_and_save_benchmark(codes=None):
+    """
+    增量更新基准指数: 查询每个指数已入库的最新日期, 并发下载后只插入新 bar.
+    不再执行 ALTER TABLE ... DELETE, 日常刷新不会触发表 mutation.
+    """
+    codes = codes or BENCHMARK_CODES
+    unknown = [c for c in codes if c not in BENCHMARKS]
+    if unknown:
+        print(f"未知的指数代码, 已忽略: {unknown}")
+    codes = [c for c in codes if c in BENCHMARKS]
+    if not codes:
+        return {}
+
+    latest = get_latest_dates(codes)
+    limiter = TokenBucket(REQUEST_RATE)
+    results = {}
+
+    print(f"正在下载 {len(codes)} 个基准指数: {', '.join(codes)}")
+    # 线程池只负责下载和清洗, 入库在主线程完成
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(codes))) as executor:
+        futures = {
+            executor.submit(retry_call, fetch_benchmark, code, latest.get(code), limiter=limiter): code
+            for code in codes
         }
-    )
-    
-    # 删除旧数据
-    client.execute(f"ALTER TABLE stock_daily DELETE WHERE ts_code = '{TARGET_CODE}'")
-    
-    # 插入的数据
-    insert_df = df[['ts_code', 'trade_date', 'open', 'high', 'low', 'close', 
-                    'pre_close', 'change', 'pct_chg', 'vol', 'amount', 'turnover_rate']]
-    
-    client.insert_dataframe(
-        'INSERT INTO stock_daily (ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount, turnover_rate) VALUES',
-        insert_df
-    )
-    
-    print(f"成功导入 {len(insert_df)} 条基准数据！")
+        for future in as_completed(futures):
+            code = futures[future]
+            try:
+                df = future.result()
+            except Exception as e:
+                print(f"{code} AkShare 下载失败: {e}")
+                results[code] = e
+                continue
+
+            if df is None:
+                print(f"{code} 已是最新 (最新日期 {latest.get(code)})")
+                results[code] = 0
+                continue
+
+            # insert_dataframe 默认放开分区写入限制 (首次导入全历史时会跨很多月份)
+            insert_dataframe('stock_daily', df, DAILY_COLUMNS)
+            print(f"{code} 新增 {len(df)} 条 ({df['trade_date'].min()} ~ {df['trade_date'].max()})")
+            results[code] = len(df)
+
+    return results
 
 if __name__ == "__main__":
-    fetch_and_save_benchmark()
+    start = datetime.now()
+    results = fetch_and_save_benchmark()
+    written = sum(v for v in results.values() if not isinstance(v, Exception))
+    failed = [k for k, v in results.items() if isinstance(v, Exception)]
+    print(f"基准数据更新完成: 新增 {written} 条, 失败 {len(failed)} 个, 耗时 {(datetime.now() - start).total_seconds():.1f}s")
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from tqdm import tqdm
+import os
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ak_replay import ak
+from infra.rate_limit import TokenBucket, retry_call
+from infra.db import insert_dataframe
+from infra.concept_members import MEMBERS_TABLE, MEMBERS_COLUMNS, ensure_members_table, load_intervals, diff_snapshot
+
+# 成分股快照抓取配置, 与 fetch_concepts 共用同一套限速参数
+MAX_WORKERS = int(os.getenv("CONCEPT_WORKERS", "8"))
+REQUEST_RATE = float(os.getenv("CONCEPT_RATE", "4"))
+REQUEST_BURST = int(os.getenv("CONCEPT_BURST", "4"))
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+
+def fetch_constituents(concept_name):
+    # 空结果多半是接口抖动: 抛异常让 retry_call 重试, 重试耗尽记为失败, 不能当成板块成员被清空
+    df = ak.stock_board_concept_cons_em(symbol=concept_name)
+    if df is None or df.empty:
+        raise ValueError(f"板块 {concept_name} 的成分股为空")
+    return set(df['代码'].astype(str).str.zfill(6))
+
+def take_snapshot(concept_names, max_workers=MAX_WORKERS, limiter=None):
+    """并发抓取所有板块当前的成分股, 返回 ({板块名: 成分股集合}, 失败板块列表)"""
+    limiter = limiter or TokenBucket(REQUEST_RATE, REQUEST_BURST)
+    snapshot, failed = {}, []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(retry_call, fetch_constituents, name,
+                            retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, limiter=limiter): name
+            for name in concept_names
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            name = futures[future]
+            try:
+                snapshot[name] = future.result()
+            except Exception as e:
+                failed.append((name, e))
+    return snapshot, failed
+
+def refresh_members():
+    """
+    增量刷新成分股区间表: 抓取今日快照, 与库里仍有效的区间对比, 只写入新增/移出的成员.
+    已从板块列表下线的概念, 其成员区间全部关闭.
+    """
+    ensure_members_table()
+    limiter = TokenBucket(REQUEST_RATE, REQUEST_BURST)
+    try:
+        concepts = retry_call(ak.stock_board_concept_name_em,
+                              retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, limiter=limiter)
+    except Exception as e:
+        print(f"无法获取板块列表: {e}")
+        return 0
+    if concepts is None or concepts.empty:
+        print("无法获取板块列表")
+        return 0
+    names = concepts['板块名称'].astype(str).tolist()
+
+    print(f"正在抓取 {len(names)} 个板块的成分股快照...")
+    snapshot, failed = take_snapshot(names, limiter=limiter)
+
+    open_df = load_intervals(open_only=True)
+    delisted = set(open_df['concept_name']) - set(names)
+    for name in delisted:
+        snapshot[name] = set()
+
+    now = datetime.now().replace(microsecond=0)
+    changes = diff_snapshot(open_df, snapshot, now.date(), now)
+    written = insert_dataframe(MEMBERS_TABLE, changes, MEMBERS_COLUMNS)
+
+    print(f"成分股更新完成: 写入 {written} 条区间变更, 下线板块 {len(delisted)} 个, 失败 {len(failed)} 个")
+    for name, err in failed:
+        print(f"  失败: {name} -> {type(err).__name__}: {err}")
+    return written
+
+if __name__ == "__main__":
+    refresh_members()
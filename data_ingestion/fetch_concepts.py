@@ -1,18 +1,33 @@
-import akshare as ak
 import pandas as pd
 from datetime import datetime, timedelta
-from clickhouse_driver import Client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from tqdm import tqdm
+import os
+import sys
 import time
-import random
-import requests
 
-# 连接 ClickHouse
-client = Client(host='..., user='...', password='', database='stock_data', settings={'use_numpy': True})
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ak_replay import ak
+from infra.rate_limit import TokenBucket, retry_call
+from infra.ch_writer import BufferedInserter
+from infra.db import execute, get_ch_client
 
-# 建表
-client.execute("""
-CREATE TABLE IF NOT EXISTS stock_data.stock_concept_daily
+# 并发下载配置: 线程数与令牌桶限速 (每秒请求数 / 突发容量), 吞吐由东财能承受的频率决定
+MAX_WORKERS = int(os.getenv("CONCEPT_WORKERS", "8"))
+REQUEST_RATE = float(os.getenv("CONCEPT_RATE", "4"))
+REQUEST_BURST = int(os.getenv("CONCEPT_BURST", "4"))
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+# 攒够这么多行 (或 60 秒) 才写一次库, 避免每个板块生成一个小 part
+INSERT_BATCH_ROWS = 500000
+
+CONCEPT_COLUMNS = ['concept_name', 'concept_code', 'trade_date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'pct_chg']
+
+def ensure_table():
+    # 建表 (只在脚本运行时执行, import 本模块不会连库)
+    execute("""
+CREATE TABLE IF NOT EXISTS stock_concept_daily
 (
     `concept_name` LowCardinality(String),
     `concept_code` String,
@@ -47,62 +62,101 @@ def get_concept_status():
     """
     try:
         sql = "SELECT concept_name, max(trade_date) FROM stock_concept_daily GROUP BY concept_name"
-        result = client.execute(sql)
+        result = execute(sql)
         return {row[0]: row[1] for row in result}
     except Exception:
         return {}
 
-def download_concept_history(concept_name, concept_code, start_date):
-    end_date = datetime.now().strftime("%Y%m%d")
-    s_date_str = start_date.strftime("%Y%m%d")
+def fetch_concept_history(concept_name, concept_code, start_date, end_date):
+    """下载并清洗单个板块的日K, 网络失败直接抛异常 (由调用方负责重试)"""
+    df = ak.stock_board_concept_hist_em(
+        symbol=concept_name, 
+        period="daily", 
+        start_date=start_date.strftime("%Y%m%d"), 
+        end_date=end_date, 
+        adjust=""
+    )
+    if df is None or df.empty:
+        return None
+
+    # 清洗
+    rename_dict = {
+        '日期': 'trade_date', '开盘': 'open', '最高': 'high', '最低': 'low',
+        '收盘': 'close', '成交量': 'vol', '成交额': 'amount', '涨跌幅': 'pct_chg'
+    }
+    df = df.rename(columns=rename_dict)
+    df['concept_name'] = concept_name
+    df['concept_code'] = str(concept_code)
+    df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
     
-    if s_date_str > end_date:
-        return False
+    df = df[df['trade_date'] >= start_date]
+    if df.empty:
+        return None
 
-    for attempt in range(3):
-        try:
-            # 获取数据
-            df = ak.stock_board_concept_hist_em(
-                symbol=concept_name, 
-                period="daily", 
-                start_date=s_date_str, 
-                end_date=end_date, 
-                adjust=""
-            )
-            
-            if df is None or df.empty: return False
-
-            # 清洗
-            rename_dict = {
-                '日期': 'trade_date', '开盘': 'open', '最高': 'high', '最低': 'low',
-                '收盘': 'close', '成交量': 'vol', '成交额': 'amount', '涨跌幅': 'pct_chg'
-            }
-            df = df.rename(columns=rename_dict)
-            df['concept_name'] = concept_name
-            df['concept_code'] = str(concept_code)
-            df['trade_date'] = pd.to_datetime(df['trade_date']).dt.date
-            
-            df = df[df['trade_date'] >= start_date]
-            if df.empty: return False
-
-            # all to numeric
-            cols = ['open', 'high', 'low', 'close', 'vol', 'amount', 'pct_chg']
-            for c in cols:
-                df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
-
-            final_cols = ['concept_name', 'concept_code', 'trade_date', 'open', 'high', 'low', 'close', 'vol', 'amount', 'pct_chg']
-            
-            client.insert_dataframe(
-                'INSERT INTO stock_concept_daily (concept_name, concept_code, trade_date, open, high, low, close, vol, amount, pct_chg) VALUES',
-                df[final_cols]
+    # all to numeric
+    cols = ['open', 'high', 'low', 'close', 'vol', 'amount', 'pct_chg']
+    for c in cols:
+        df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
+
+    return df[CONCEPT_COLUMNS]
+
+def concept_writer():
+    return BufferedInserter(get_ch_client(), 'stock_concept_daily', CONCEPT_COLUMNS, max_rows=INSERT_BATCH_ROWS)
+
+def download_all(tasks, max_workers=MAX_WORKERS):
+    """
+    并发下载: 线程池只负责网络请求 + 清洗, 入库统一在主线程通过 BufferedInserter 批量完成
+    (clickhouse_driver 的 Client 不是线程安全的).
+    返回 {板块名: 行数 或 异常}
+    """
+    limiter = TokenBucket(REQUEST_RATE, REQUEST_BURST)
+    end_date = datetime.now().strftime("%Y%m%d")
+    results = {}
+
+    with concept_writer() as writer, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for name, code, start_date in tasks:
+            if start_date.strftime("%Y%m%d") > end_date:
+                results[name] = 0
+                continue
+            future = executor.submit(
+                retry_call, fetch_concept_history, name, code, start_date, end_date,
+                retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, limiter=limiter
             )
-            return True
-        except Exception:
-            time.sleep(1)
-            
-    return False
+            futures[future] = name
+
+        pbar = tqdm(as_completed(futures), total=len(futures))
+        for future in pbar:
+            name = futures[future]
+            pbar.set_description(f"更新 {name}")
+            try:
+                df = future.result()
+                if df is None:
+                    results[name] = 0
+                else:
+                    writer.add(df)
+                    results[name] = len(df)
+            except Exception as e:
+                results[name] = e
+
+        pbar.close()
+        print("正在写入剩余缓冲数据...")
+
+    print(f"本次共 {writer.flush_count} 次批量写入, {writer.total_rows} 行")
+    return results
+
+def report_results(results):
+    failed = {k: v for k, v in results.items() if isinstance(v, Exception)}
+    updated = {k: v for k, v in results.items() if not isinstance(v, Exception) and v > 0}
+    empty = len(results) - len(failed) - len(updated)
+
+    print(f"更新成功 {len(updated)} 个板块, 共 {sum(updated.values())} 行; 无新数据 {empty} 个; 失败 {len(failed)} 个")
+    for name, err in sorted(failed.items()):
+        print(f"  失败: {name} -> {type(err).__name__}: {err}")
+    return failed
 
 if __name__ == "__main__":
+    ensure_table()
     concepts_df = get_all_concepts()
     if concepts_df.empty:
         print("无法获取板块列表")
@@ -137,11 +191,11 @@ if __name__ == "__main__":
         print("所有板块数据已是最新, 无需更新。")
         exit()
 
-    # 进度条
-    pbar = tqdm(tasks)
-    for name, code, start_date in pbar:
-        pbar.set_description(f"更新 {name}")
-        download_concept_history(name, code, start_date)
-        time.sleep(random.uniform(0.2, 0.5)) # 稍微休眠，防封
-            
-    print("板块数据更新完成!")
+    print(f"并发下载: {MAX_WORKERS} 线程, 限速 {REQUEST_RATE} 次/秒 (突发 {REQUEST_BURST})")
+    results = download_all(tasks)
+    failed = report_results(results)
+
+    if failed:
+        print("部分板块更新失败, 重新运行即可从断点续传.")
+    else:
+        print("板块数据更新完成!")
@@ -1,75 +1,190 @@
-import akshare as ak
 import pandas as pd
 from datetime import datetime, date, time
+import hashlib
+import os
+import sys
+from pathlib import Path
 import pymongo
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ak_replay import ak
+from infra.db import get_collection
 
 # Config
-MONGO_URI = "..."
-DB_NAME = "stock_data"
 COLLECTION_NAME = "news_cailianshe"
+HASH_FIELD = "content_hash"
+DUPLICATE_KEY_ERROR = 11000
+
+def news_collection():
+    # 共享连接池里的集合句柄, 第一次调用时才连接 MongoDB
+    return get_collection(COLLECTION_NAME)
+
+def _text(value):
+    # None 和 NaN (DataFrame 里缺失的单元格) 都当作空串, 不能让 NaN 变成 'nan' 参与指纹
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value).strip()
+
+def _doc_text(doc, *keys):
+    for key in keys:
+        text = _text(doc.get(key))
+        if text:
+            return text
+    return ''
+
+def content_hash(content, title=None, publish_time=None, publish_date=None):
+    """
+    电报的稳定指纹: 优先用正文 (去掉首尾空白), 正文为空时退化为 标题 + 发布日期 + 发布时间
+    (财联社的 发布时间 只有时分秒, 不带日期时不同日同一时刻的同名电报会被当成重复)
+    """
+    text = _text(content)
+    if not text:
+        stamp = f"{_text(publish_date)} {_text(publish_time)}".strip()
+        text = f"{_text(title)}|{stamp}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def ensure_indexes():
+    """
+    content_hash 唯一索引, 去重交给数据库完成.
+    老文档没有 content_hash 字段, 用 partial index 避免它们之间互相冲突.
+    """
+    news_collection().create_index(
+        HASH_FIELD,
+        unique=True,
+        partialFilterExpression={HASH_FIELD: {"$exists": True}},
+        name=f"{HASH_FIELD}_unique",
+    )
+
+def _text_column(df, *names):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series([None] * len(df), index=df.index)
+
+def normalize_columns(df):
+    """按列把 MongoDB 不认识的 date/time 对象转成字符串 (代替逐值判断)"""
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            df[col] = series.astype(str)
+        elif series.dtype == object:
+            sample = series.dropna()
+            if not sample.empty and isinstance(sample.iloc[0], (date, time)):
+                df[col] = series.map(lambda v: str(v) if isinstance(v, (date, time)) else v)
+    return df
+
+def build_documents(df):
+    df = normalize_columns(df)
+    contents = _text_column(df, 'content', '内容')
+    titles = _text_column(df, 'title', '标题')
+    pub_times = _text_column(df, 'publish_time', '发布时间')
+    pub_dates = _text_column(df, 'publish_date', '发布日期')
+    df[HASH_FIELD] = [content_hash(c, t, p, d) for c, t, p, d in zip(contents, titles, pub_times, pub_dates)]
+
+    docs = df.to_dict('records')
+    # 补充抓取时间 (用原生 datetime, 不用 pandas Timestamp)
+    crawled_at = datetime.now()
+    for doc in docs:
+        doc['crawled_at'] = crawled_at
+    return docs
+
+def insert_documents(docs):
+    """
+    单次无序 insert_many, 重复内容由唯一索引拒绝; 返回新增条数.
+    除重复键以外的写入错误照常抛出.
+    """
+    if not docs:
+        return 0
+    try:
+        result = news_collection().insert_many(docs, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        details = e.details
+        other_errors = [err for err in details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY_ERROR]
+        if other_errors:
+            raise
+        return details.get('nInserted', 0)
+
+def backfill_content_hash(batch_size=1000):
+    """
+    一次性给历史文档补 content_hash, 让新抓取的电报也能和老数据去重.
+    没有正文的文档即使已有 content_hash 也重新计算, 保证都按 标题 + 发布日期 + 发布时间 取指纹.
+    老数据内部本身的重复项会因唯一索引写入失败, 保持原样即可.
+    """
+    ensure_indexes()
+    # 正文缺失时 DataFrame 写进来的是 NaN, 和 None / 空串一样算没有正文
+    no_body = {'$and': [{'content': {'$in': [None, '', float('nan')]}},
+                        {'内容': {'$in': [None, '', float('nan')]}}]}
+    cursor = news_collection().find(
+        {'$or': [{HASH_FIELD: {"$exists": False}}, no_body]},
+        {'content': 1, '内容': 1, 'title': 1, '标题': 1, 'publish_time': 1, '发布时间': 1,
+         'publish_date': 1, '发布日期': 1},
+    )
+    updated = 0
+    ops = []
 
-print("正在连接 MongoDB...")
-client = pymongo.MongoClient(MONGO_URI)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+    def _flush(ops):
+        if not ops:
+            return 0
+        try:
+            return news_collection().bulk_write(ops, ordered=False).modified_count
+        except BulkWriteError as e:
+            return e.details.get('nModified', 0)
 
-print("MongoDB 连接成功")
+    for doc in cursor:
+        h = content_hash(
+            _doc_text(doc, 'content', '内容'),
+            _doc_text(doc, 'title', '标题'),
+            _doc_text(doc, 'publish_time', '发布时间'),
+            _doc_text(doc, 'publish_date', '发布日期'),
+        )
+        ops.append(pymongo.UpdateOne({'_id': doc['_id']}, {'$set': {HASH_FIELD: h}}))
+        if len(ops) >= batch_size:
+            updated += _flush(ops)
+            ops = []
+    updated += _flush(ops)
+    print(f"历史文档补充 {HASH_FIELD} 完成: {updated} 条")
+    return updated
 
 def fetch_and_save_news():
     print("正在抓取财联社 7x24 小时电报...")
-    
+
     try:
         df = ak.stock_info_global_cls()
-        
+
         if df is None or df.empty:
             print("未抓取到新闻")
             return
 
         print(f"抓取到 {len(df)} 条快讯. ")
-        
-        inserted_count = 0
-        
-        for _, row in df.iterrows():
-            news_item = row.to_dict()
-            
-            # 遍历所有字段，把 MongoDB 不认识的 date/time 对象转成字符串
-            for key, value in news_item.items():
-                if isinstance(value, (date, time)):
-                    news_item[key] = str(value)
-            
-            # 补充抓取时间
-            news_item['crawled_at'] = datetime.now()
-            
-            # 去重检查：用 '内容' 字段判断是否已存在
-            content_val = news_item.get('content') or news_item.get('内容')
-            
-            if content_val:
-                # 检查库里是否已有该内容
-                if collection.find_one({"内容": content_val}) or collection.find_one({"content": content_val}):
-                    continue
-            
-            collection.insert_one(news_item)
-            inserted_count += 1
-                
+
+        ensure_indexes()
+        inserted_count = insert_documents(build_documents(df))
+
         print(f"入库完成！新增: {inserted_count} 条")
-        
+
     except Exception as e:
         print(f"抓取失败: {e}")
 
 if __name__ == "__main__":
+    # 首次升级到 hash 去重时运行一次: NEWS_BACKFILL_HASH=1 python data_ingestion/fetch_news.py
+    if os.getenv("NEWS_BACKFILL_HASH", "0") == "1":
+        backfill_content_hash()
+
     fetch_and_save_news()
-    
+
     # 验证
-    count = collection.count_documents({})
+    count = news_collection().estimated_document_count()
     print(f"\nMongoDB '{COLLECTION_NAME}' 表当前总文档数: {count}")
-    
+
     if count > 0:
-        latest = collection.find_one(sort=[("crawled_at", -1)])
+        latest = news_collection().find_one(sort=[("crawled_at", -1)])
         print("\n最新一条新闻预览: ")
         print(f"时间: {latest.get('发布时间') or latest.get('time')}")
         print(f"标题: {latest.get('标题') or latest.get('title')}")
-        
+
         # 内容的前 50 个字
         content = latest.get('内容') or latest.get('content') or ''
         print(f"内容: {content[:50]}...")
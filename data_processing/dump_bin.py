@@ -3,11 +3,12 @@
 
 import abc
 import shutil
+import tempfile
 import traceback
 from pathlib import Path
 from typing import Iterable, List, Union
 from functools import partial
-from concurrent.futures import ThreadPoolExecutor, as_completed, ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait, ProcessPoolExecutor
 
 import fire
 import numpy as np
@@ -15,9 +16,10 @@ import pandas as pd
 from tqdm import tqdm
 from loguru import logger
 from qlib.utils import fname_to_code, code_to_fname
+from qlib_writer import detach_file, publish_dir, snapshot_dir, stage_dir
 
 
-def read_as_df(file_path: Union[str, Path], **kwargs) -> pd.DataFrame:
+def read_as_df(file_path: Union[str, Path], columns: Iterable[str] = None, **kwargs) -> pd.DataFrame:
     """
     Read a csv or parquet file into a pandas DataFrame.
 
@@ -25,6 +27,9 @@ def read_as_df(file_path: Union[str, Path], **kwargs) -> pd.DataFrame:
     ----------
     file_path : Union[str, Path]
         Path to the data file.
+    columns : Iterable[str], optional
+        Only read these columns; columns missing from the file are ignored.
+        By default all columns are read.
     **kwargs :
         Additional keyword arguments passed to the underlying pandas
         reader.
@@ -43,13 +48,33 @@ def read_as_df(file_path: Union[str, Path], **kwargs) -> pd.DataFrame:
             kept_kwargs[k] = kwargs[k]
 
     if suffix == ".csv":
+        if columns is not None:
+            wanted = set(columns)
+            kept_kwargs["usecols"] = lambda c: c in wanted
         return pd.read_csv(file_path, **kept_kwargs)
     elif suffix == ".parquet":
+        if columns is not None:
+            import pyarrow.parquet as pq
+
+            names = pq.read_schema(file_path).names
+            kept_kwargs["columns"] = [c for c in names if c in set(columns)]
         return pd.read_parquet(file_path, **kept_kwargs)
     else:
         raise ValueError(f"Unsupported file format: {suffix}")
 
 
+# pyarrow datasets opened in this process, see DumpDataBase._open_dataset
+_DATASETS = {}
+# calendar of the running dump as sorted int64 nanoseconds, installed once per worker process by the pool initializer
+# (inherited on fork) instead of being pickled with every task
+_CALENDAR = None
+
+
+def _init_calendar(calendar: np.ndarray):
+    global _CALENDAR
+    _CALENDAR = calendar
+
+
 class DumpDataBase:
     INSTRUMENTS_START_FIELD = "start_datetime"
     INSTRUMENTS_END_FIELD = "end_datetime"
@@ -64,6 +89,15 @@ class DumpDataBase:
 
     UPDATE_MODE = "update"
     ALL_MODE = "all"
+    # parent-only state, kept out of the pickled tasks; the workers read the calendar from _CALENDAR
+    PARENT_ONLY_ATTRS = (
+        "_calendars_list",
+        "_kwargs",
+        "_old_instruments",
+        "_update_instruments",
+        "_old_calendar_list",
+        "_new_calendar_list",
+    )
 
     def __init__(
         self,
@@ -78,6 +112,8 @@ class DumpDataBase:
         exclude_fields: str = "",
         include_fields: str = "",
         limit_nums: int = None,
+        dataset: bool = False,
+        single_pass: bool = True,
     ):
         """
 
@@ -88,7 +124,7 @@ class DumpDataBase:
         qlib_dir: str
             qlib(dump) data director
         backup_dir: str, default None
-            if backup_dir is not None, backup qlib_dir to backup_dir
+            if backup_dir is not None, backup qlib_dir to backup_dir (a hardlink snapshot, dumps never modify it)
         freq: str, default "day"
             transaction frequency
         max_workers: int, default None
@@ -105,6 +141,14 @@ class DumpDataBase:
             fields not dumped
         limit_nums: int
             Use when debugging, default None
+        dataset: bool, default False
+            data_path is a single Parquet file or a (hive-partitioned) Parquet dataset directory holding all symbols,
+            identified by symbol_field_name; rows of one symbol must be contiguous (e.g. sorted by symbol).
+            Only the dumped fields plus date/symbol are read.
+        single_pass: bool, default True
+            dump_all only: parse each source file once, keeping its dates and fields as compact arrays in a temporary
+            directory next to the bins until the calendar is known and the bins are written; False reads every file
+            twice (dates first, then the fields) without the temporary copy. Not used in dataset mode.
         """
         data_path = Path(data_path).expanduser()
         if isinstance(exclude_fields, str):
@@ -115,9 +159,17 @@ class DumpDataBase:
         self._include_fields = tuple(filter(lambda x: len(x) > 0, map(str.strip, include_fields)))
         self.file_suffix = file_suffix
         self.symbol_field_name = symbol_field_name
-        self.df_files = sorted(data_path.glob(f"*{self.file_suffix}") if data_path.is_dir() else [data_path])
-        if limit_nums is not None:
-            self.df_files = self.df_files[: int(limit_nums)]
+        self.data_path = data_path
+        self.dataset = dataset
+        self.limit_nums = None if limit_nums is None else int(limit_nums)
+        self.single_pass = single_pass
+        self._cache_dir = None
+        if self.dataset:
+            self.df_files = []
+        else:
+            self.df_files = sorted(data_path.glob(f"*{self.file_suffix}") if data_path.is_dir() else [data_path])
+            if limit_nums is not None:
+                self.df_files = self.df_files[: int(limit_nums)]
         self.qlib_dir = Path(qlib_dir).expanduser()
         self.backup_dir = backup_dir if backup_dir is None else Path(backup_dir).expanduser()
         if backup_dir is not None:
@@ -129,17 +181,41 @@ class DumpDataBase:
         self.works = max_workers
         self.date_field_name = date_field_name
 
-        self._calendars_dir = self.qlib_dir.joinpath(self.CALENDARS_DIR_NAME)
-        self._features_dir = self.qlib_dir.joinpath(self.FEATURES_DIR_NAME)
-        self._instruments_dir = self.qlib_dir.joinpath(self.INSTRUMENTS_DIR_NAME)
+        self._set_target_dir(self.qlib_dir)
 
         self._calendars_list = []
 
         self._mode = self.ALL_MODE
         self._kwargs = {}
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.PARENT_ONLY_ATTRS:
+            state.pop(name, None)
+        return state
+
+    def _calendar_executor(self, calendar_list: List[pd.Timestamp]) -> ProcessPoolExecutor:
+        """process pool whose workers align against calendar_list (see _init_calendar)"""
+        calendar = self._calendar_array(calendar_list)
+        _init_calendar(calendar)
+        return ProcessPoolExecutor(max_workers=self.works, initializer=_init_calendar, initargs=(calendar,))
+
+    @staticmethod
+    def _calendar_array(calendar_list: Union[List[pd.Timestamp], np.ndarray]) -> np.ndarray:
+        if isinstance(calendar_list, np.ndarray) and calendar_list.dtype == np.int64:
+            return calendar_list
+        return pd.DatetimeIndex(list(calendar_list)).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def _set_target_dir(self, target_dir: Path):
+        """directory the dump reads and writes: qlib_dir itself, or its staging snapshot in __call__"""
+        self._target_dir = target_dir
+        self._calendars_dir = target_dir.joinpath(self.CALENDARS_DIR_NAME)
+        self._features_dir = target_dir.joinpath(self.FEATURES_DIR_NAME)
+        self._instruments_dir = target_dir.joinpath(self.INSTRUMENTS_DIR_NAME)
+
     def _backup_qlib_dir(self, target_dir: Path):
-        shutil.copytree(str(self.qlib_dir.resolve()), str(target_dir.resolve()))
+        # files are never modified in place (see detach_file), so hardlinks are a consistent backup
+        snapshot_dir(self.qlib_dir.resolve(), target_dir.resolve())
 
     def _format_datetime(self, datetime_d: [str, pd.Timestamp]):
         datetime_d = pd.Timestamp(datetime_d)
@@ -149,7 +225,7 @@ class DumpDataBase:
         self, file_or_df: [Path, pd.DataFrame], *, is_begin_end: bool = False, as_set: bool = False
     ) -> Iterable[pd.Timestamp]:
         if not isinstance(file_or_df, pd.DataFrame):
-            df = self._get_source_data(file_or_df)
+            df = self._get_source_data(file_or_df, columns=[self.date_field_name])
         else:
             df = file_or_df
         if df.empty or self.date_field_name not in df.columns.tolist():
@@ -166,13 +242,98 @@ class DumpDataBase:
         else:
             return _calendars.tolist()
 
-    def _get_source_data(self, file_path: Path) -> pd.DataFrame:
-        df = read_as_df(file_path, low_memory=False)
+    def _get_source_data(self, file_path: Path, columns: Iterable[str] = None) -> pd.DataFrame:
+        df = read_as_df(file_path, columns=columns, low_memory=False)
         if self.date_field_name in df.columns:
             df[self.date_field_name] = pd.to_datetime(df[self.date_field_name])
         # df.drop_duplicates([self.date_field_name], inplace=True)
         return df
 
+    def _source_columns(self) -> Union[List[str], None]:
+        """columns needed to dump features; None (all columns) when only exclude_fields is given"""
+        if not self._include_fields:
+            return None
+        return [self.date_field_name, self.symbol_field_name, *self._include_fields]
+
+    def _open_dataset(self):
+        """the source Parquet dataset, discovered once per process"""
+        key = (str(self.data_path), self.symbol_field_name)
+        if key not in _DATASETS:
+            import pyarrow as pa
+            import pyarrow.dataset as pads
+
+            partitioning = "hive"
+            if self.data_path.is_dir() and any(self.data_path.glob(f"**/{self.symbol_field_name}=*")):
+                # read the symbol partition key as string, otherwise hive discovery turns "000001" into 1
+                partitioning = pads.HivePartitioning.discover(schema=pa.schema([(self.symbol_field_name, pa.string())]))
+            dataset = pads.dataset(str(self.data_path), format="parquet", partitioning=partitioning)
+            if self.symbol_field_name not in dataset.schema.names:
+                raise ValueError(f"{self.data_path}: no {self.symbol_field_name} column in dataset")
+            _DATASETS[key] = dataset
+        return _DATASETS[key]
+
+    def _dataset_columns(self, dataset, columns: Iterable[str] = None) -> Union[List[str], None]:
+        if columns is None:
+            return None
+        wanted = {self.date_field_name, self.symbol_field_name, *columns}
+        return [c for c in dataset.schema.names if c in wanted]
+
+    def _read_dataset_symbol(self, symbol, columns: Iterable[str] = None) -> pd.DataFrame:
+        """
+        Read the rows of one symbol from the dataset. The filter prunes the other hive partitions, and the other row
+        groups of a dataset sorted by symbol via the Parquet statistics, so only this symbol is decoded.
+        """
+        import pyarrow.dataset as pads
+
+        dataset = self._open_dataset()
+        df = dataset.to_table(
+            filter=pads.field(self.symbol_field_name) == symbol, columns=self._dataset_columns(dataset, columns)
+        ).to_pandas()
+        df[self.date_field_name] = pd.to_datetime(df[self.date_field_name])
+        return df
+
+    def _iter_dataset(self, columns: Iterable[str] = None) -> Iterable[pd.DataFrame]:
+        """
+        Yield one DataFrame per symbol from a multi-symbol Parquet dataset, in file/row-group order.
+
+        Only `columns` (plus date/symbol) are decoded. A symbol may span several row groups, but its rows must be
+        contiguous; a symbol that reappears after another one raises ValueError.
+        """
+        dataset = self._open_dataset()
+        columns = self._dataset_columns(dataset, columns)
+
+        seen = set()
+        pending = []
+        pending_symbol = None
+
+        def _flush():
+            df = pd.concat(pending, ignore_index=True) if len(pending) > 1 else pending[0]
+            df[self.date_field_name] = pd.to_datetime(df[self.date_field_name])
+            return df
+
+        for fragment in dataset.get_fragments():
+            for batch in fragment.to_batches(schema=dataset.schema, columns=columns):
+                if batch.num_rows == 0:
+                    continue
+                df = batch.to_pandas()
+                symbols = df[self.symbol_field_name].astype(str).to_numpy()
+                bounds = np.flatnonzero(symbols[1:] != symbols[:-1]) + 1
+                for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(df)]])):
+                    symbol = symbols[lo]
+                    if symbol == pending_symbol:
+                        pending.append(df.iloc[lo:hi])
+                        continue
+                    if pending:
+                        yield _flush()
+                        if self.limit_nums is not None and len(seen) >= self.limit_nums:
+                            return
+                    if symbol in seen:
+                        raise ValueError(f"{self.data_path}: rows of {symbol} are not contiguous, sort the dataset by symbol")
+                    seen.add(symbol)
+                    pending, pending_symbol = [df.iloc[lo:hi]], symbol
+        if pending:
+            yield _flush()
+
     def get_symbol_from_file(self, file_path: Path) -> str:
         return fname_to_code(file_path.stem.strip().lower())
 
@@ -209,11 +370,13 @@ class DumpDataBase:
         self._calendars_dir.mkdir(parents=True, exist_ok=True)
         calendars_path = str(self._calendars_dir.joinpath(f"{self.freq}.txt").expanduser().resolve())
         result_calendars_list = [self._format_datetime(x) for x in calendars_data]
+        detach_file(calendars_path, keep=False)
         np.savetxt(calendars_path, result_calendars_list, fmt="%s", encoding="utf-8")
 
     def save_instruments(self, instruments_data: Union[list, pd.DataFrame]):
         self._instruments_dir.mkdir(parents=True, exist_ok=True)
         instruments_path = str(self._instruments_dir.joinpath(self.INSTRUMENTS_FILE_NAME).resolve())
+        detach_file(instruments_path, keep=False)
         if isinstance(instruments_data, pd.DataFrame):
             _df_fields = [self.symbol_field_name, self.INSTRUMENTS_START_FIELD, self.INSTRUMENTS_END_FIELD]
             instruments_data = instruments_data.loc[:, _df_fields]
@@ -224,52 +387,59 @@ class DumpDataBase:
         else:
             np.savetxt(instruments_path, instruments_data, fmt="%s", encoding="utf-8")
 
-    def data_merge_calendar(self, df: pd.DataFrame, calendars_list: List[pd.Timestamp]) -> pd.DataFrame:
-        # calendars
-        calendars_df = pd.DataFrame(data=calendars_list, columns=[self.date_field_name])
-        calendars_df[self.date_field_name] = calendars_df[self.date_field_name].astype("datetime64[ns]")
-        cal_df = calendars_df[
-            (calendars_df[self.date_field_name] >= df[self.date_field_name].min())
-            & (calendars_df[self.date_field_name] <= df[self.date_field_name].max())
-        ]
-        # align index
-        cal_df.set_index(self.date_field_name, inplace=True)
-        df.set_index(self.date_field_name, inplace=True)
-        r_df = df.reindex(cal_df.index)
-        return r_df
-
-    @staticmethod
-    def get_datetime_index(df: pd.DataFrame, calendar_list: List[pd.Timestamp]) -> int:
-        return calendar_list.index(df.index.min())
-
-    def _data_to_bin(self, df: pd.DataFrame, calendar_list: List[pd.Timestamp], features_dir: Path):
+    def _data_to_bin(self, df: pd.DataFrame, calendar: np.ndarray, features_dir: Path):
         if df.empty:
             logger.warning(f"{features_dir.name} data is None or empty")
             return
-        if not calendar_list:
+        fields = [f for f in self.get_dump_fields(df.columns.drop(self.date_field_name)) if f in df.columns]
+        self._arrays_to_bin(
+            df[self.date_field_name].to_numpy(dtype="datetime64[ns]"),
+            {field: np.array(df[field]).astype("<f") for field in fields},
+            calendar,
+            features_dir,
+        )
+
+    def _arrays_to_bin(self, dates: np.ndarray, fields: dict, calendar: np.ndarray, features_dir: Path):
+        """dates: datetime64[ns] array; fields: {field: float32 array of the same length}"""
+        if not len(calendar):
             logger.warning("calendar_list is empty")
             return
-        # align index
-        _df = self.data_merge_calendar(df, calendar_list)
-        if _df.empty:
+        # align index: the symbol occupies calendar[start:stop], from its first to its last date;
+        # dates missing from the data stay NaN and dates missing from the calendar are dropped
+        valid = ~np.isnat(dates)
+        dates = dates.view(np.int64)
+        start = stop = 0
+        if valid.any():
+            start = int(np.searchsorted(calendar, dates[valid].min(), side="left"))
+            stop = int(np.searchsorted(calendar, dates[valid].max(), side="right"))
+        if stop <= start:
             logger.warning(f"{features_dir.name} data is not in calendars")
             return
-        # used when creating a bin file
-        date_index = self.get_datetime_index(_df, calendar_list)
-        for field in self.get_dump_fields(_df.columns):
+        pos = np.searchsorted(calendar, dates)
+        hit = valid & (pos < stop)
+        hit[hit] = calendar[pos[hit]] == dates[hit]
+        offsets = pos[hit] - start
+        # the first value of a new bin file is the index of its first date in the calendar
+        buf = np.empty(stop - start + 1, dtype="<f")
+        for field, values in fields.items():
             bin_path = features_dir.joinpath(f"{field.lower()}.{self.freq}{self.DUMP_FILE_SUFFIX}")
-            if field not in _df.columns:
-                continue
+            buf[0] = start
+            buf[1:] = np.nan
+            buf[1:][offsets] = values[hit]
             if bin_path.exists() and self._mode == self.UPDATE_MODE:
                 # update
+                detach_file(bin_path)
                 with bin_path.open("ab") as fp:
-                    np.array(_df[field]).astype("<f").tofile(fp)
+                    buf[1:].tofile(fp)
             else:
                 # append; self._mode == self.ALL_MODE or not bin_path.exists()
-                np.hstack([date_index, _df[field]]).astype("<f").tofile(str(bin_path.resolve()))
+                detach_file(bin_path, keep=False)
+                buf.tofile(str(bin_path.resolve()))
 
-    def _dump_bin(self, file_or_data: [Path, pd.DataFrame], calendar_list: List[pd.Timestamp]):
-        if not calendar_list:
+    def _dump_bin(self, file_or_data: [Path, pd.DataFrame], calendar_list: List[pd.Timestamp] = None):
+        """calendar_list defaults to the calendar installed in this process by _calendar_executor"""
+        calendar = _CALENDAR if calendar_list is None else self._calendar_array(calendar_list)
+        if calendar is None or not len(calendar):
             logger.warning("calendar_list is empty")
             return
         if isinstance(file_or_data, pd.DataFrame):
@@ -279,7 +449,7 @@ class DumpDataBase:
             df = file_or_data
         elif isinstance(file_or_data, Path):
             code = self.get_symbol_from_file(file_or_data)
-            df = self._get_source_data(file_or_data)
+            df = self._get_source_data(file_or_data, columns=self._source_columns())
         else:
             raise ValueError(f"not support {type(file_or_data)}")
         if df is None or df.empty:
@@ -292,28 +462,103 @@ class DumpDataBase:
         # features save dir
         features_dir = self._features_dir.joinpath(code_to_fname(code).lower())
         features_dir.mkdir(parents=True, exist_ok=True)
-        self._data_to_bin(df, calendar_list, features_dir)
+        self._data_to_bin(df, calendar, features_dir)
 
     @abc.abstractmethod
     def dump(self):
         raise NotImplementedError("dump not implemented!")
 
     def __call__(self, *args, **kwargs):
-        self.dump()
+        """
+        Dump into a hardlink snapshot of qlib_dir and publish it by an atomic symlink swap, so readers of qlib_dir
+        never see a partially written dataset (see qlib_writer.publish_dir); dump() alone writes qlib_dir in place.
+        """
+        staging = stage_dir(self.qlib_dir)
+        self._set_target_dir(staging)
+        try:
+            self.dump()
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        finally:
+            self._set_target_dir(self.qlib_dir)
+        publish_dir(staging, self.qlib_dir)
 
 
 class DumpDataAll(DumpDataBase):
+    def _cache_path(self, file_path: Path) -> Path:
+        return self._cache_dir.joinpath(f"{file_path.stem}.npz")
+
+    def _cache_file(self, file_path: Path):
+        """
+        Single pass: parse a source file once, save its dates and dump fields as compact arrays for
+        _dump_cached_file and return ((begin, end), unique dates as datetime64[ns]).
+        """
+        df = self._get_source_data(file_path, columns=self._source_columns())
+        begin_end = self._get_date(df, is_begin_end=True)
+        if df.empty or self.date_field_name not in df.columns:
+            return begin_end, np.array([], dtype="datetime64[ns]")
+        # try to remove dup rows, same as _dump_bin
+        df = df.drop_duplicates(self.date_field_name)
+        fields = [f for f in self.get_dump_fields(df.columns.drop(self.date_field_name)) if f in df.columns]
+        values = np.empty((len(fields), len(df)), dtype="<f")
+        for i, field in enumerate(fields):
+            values[i] = np.array(df[field]).astype("<f")
+        dates = df[self.date_field_name].to_numpy(dtype="datetime64[ns]")
+        np.savez(self._cache_path(file_path), dates=dates, fields=np.array(fields, dtype=str), values=values)
+        return begin_end, np.unique(dates[~np.isnat(dates)])
+
+    def _dump_cached_file(self, file_path: Path):
+        cache_path = self._cache_path(file_path)
+        code = self.get_symbol_from_file(file_path)
+        if not cache_path.exists():
+            logger.warning(f"{code} data is None or empty")
+            return
+        with np.load(cache_path) as cached:
+            dates, fields, values = cached["dates"], cached["fields"], cached["values"]
+        features_dir = self._features_dir.joinpath(code_to_fname(code).lower())
+        features_dir.mkdir(parents=True, exist_ok=True)
+        self._arrays_to_bin(dates, dict(zip(fields.tolist(), values)), _CALENDAR, features_dir)
+        cache_path.unlink()
+
+    def _get_dataset_date_ranges(self) -> dict:
+        """{symbol: (begin, end, set of dates)}, reading only the date and symbol columns of the dataset"""
+        ranges = {}
+        for df in tqdm(self._iter_dataset([])):
+            symbol = fname_to_code(str(df[self.symbol_field_name].iloc[0]).lower())
+            (_begin_time, _end_time), _set_calendars = self._get_date(df, as_set=True, is_begin_end=True)
+            ranges[symbol] = (_begin_time, _end_time, _set_calendars)
+        return ranges
+
     def _get_all_date(self):
         logger.info("start get all date......")
         all_datetime = set()
         date_range_list = []
-        _fun = partial(self._get_date, as_set=True, is_begin_end=True)
+        if self.dataset:
+            for symbol, (_begin_time, _end_time, _set_calendars) in sorted(self._get_dataset_date_ranges().items()):
+                all_datetime = all_datetime | _set_calendars
+                if isinstance(_begin_time, pd.Timestamp) and isinstance(_end_time, pd.Timestamp):
+                    _inst_fields = [symbol.upper(), self._format_datetime(_begin_time), self._format_datetime(_end_time)]
+                    date_range_list.append(f"{self.INSTRUMENTS_SEP.join(_inst_fields)}")
+            self._kwargs["all_datetime_set"] = all_datetime
+            self._kwargs["date_range_list"] = date_range_list
+            logger.info("end of get all date.\n")
+            return
+        if self._cache_dir is None:
+            _fun = partial(self._get_date, as_set=True, is_begin_end=True)
+        else:
+            _fun = self._cache_file
+            all_dates = np.array([], dtype="datetime64[ns]")
         with tqdm(total=len(self.df_files)) as p_bar:
             with ProcessPoolExecutor(max_workers=self.works) as executor:
-                for file_path, ((_begin_time, _end_time), _set_calendars) in zip(
+                for file_path, ((_begin_time, _end_time), _calendars) in zip(
                     self.df_files, executor.map(_fun, self.df_files)
                 ):
-                    all_datetime = all_datetime | _set_calendars
+                    if self._cache_dir is None:
+                        all_datetime = all_datetime | _calendars
+                    else:
+                        # datetime64 arrays: far cheaper to pickle and merge than sets of Timestamps
+                        all_dates = np.union1d(all_dates, _calendars)
                     if isinstance(_begin_time, pd.Timestamp) and isinstance(_end_time, pd.Timestamp):
                         _begin_time = self._format_datetime(_begin_time)
                         _end_time = self._format_datetime(_end_time)
@@ -321,6 +566,8 @@ class DumpDataAll(DumpDataBase):
                         _inst_fields = [symbol.upper(), _begin_time, _end_time]
                         date_range_list.append(f"{self.INSTRUMENTS_SEP.join(_inst_fields)}")
                     p_bar.update()
+        if self._cache_dir is not None:
+            all_datetime = set(pd.DatetimeIndex(all_dates))
         self._kwargs["all_datetime_set"] = all_datetime
         self._kwargs["date_range_list"] = date_range_list
         logger.info("end of get all date.\n")
@@ -336,26 +583,71 @@ class DumpDataAll(DumpDataBase):
         self.save_instruments(self._kwargs["date_range_list"])
         logger.info("end of instruments dump.\n")
 
+    def _dump_dataset_features(self):
+        """dump a multi-symbol dataset: symbols are read one at a time and at most 2 * max_workers are in flight"""
+        pending = set()
+        with self._calendar_executor(self._calendars_list) as executor, tqdm() as p_bar:
+            for df in self._iter_dataset(self._source_columns()):
+                pending.add(executor.submit(self._dump_bin, df))
+                if len(pending) >= 2 * self.works:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for _future in done:
+                        _future.result()
+                        p_bar.update()
+            for _future in as_completed(pending):
+                _future.result()
+                p_bar.update()
+
     def _dump_features(self):
         logger.info("start dump features......")
-        _dump_func = partial(self._dump_bin, calendar_list=self._calendars_list)
+        if self.dataset:
+            self._dump_dataset_features()
+            logger.info("end of features dump.\n")
+            return
+        _dump_func = self._dump_bin if self._cache_dir is None else self._dump_cached_file
         with tqdm(total=len(self.df_files)) as p_bar:
-            with ProcessPoolExecutor(max_workers=self.works) as executor:
+            with self._calendar_executor(self._calendars_list) as executor:
                 for _ in executor.map(_dump_func, self.df_files):
                     p_bar.update()
 
         logger.info("end of features dump.\n")
 
-    def dump(self):
+    def _dump(self):
         self._get_all_date()
         self._dump_calendars()
         self._dump_instruments()
         self._dump_features()
 
+    def dump(self):
+        if not self.single_pass or self.dataset:
+            self._dump()
+            return
+        self._target_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix=".source_cache_", dir=str(self._target_dir)) as cache_dir:
+            self._cache_dir = Path(cache_dir)
+            try:
+                self._dump()
+            finally:
+                self._cache_dir = None
+
 
 class DumpDataFix(DumpDataAll):
     def _dump_instruments(self):
         logger.info("start dump instruments......")
+        if self.dataset:
+            for symbol, (_begin_time, _end_time, _) in self._get_dataset_date_ranges().items():
+                symbol = symbol.upper()
+                if symbol in self._old_instruments:
+                    continue
+                if isinstance(_begin_time, pd.Timestamp) and isinstance(_end_time, pd.Timestamp):
+                    _dt_map = self._old_instruments.setdefault(symbol, dict())
+                    _dt_map[self.INSTRUMENTS_START_FIELD] = self._format_datetime(_begin_time)
+                    _dt_map[self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end_time)
+            _inst_df = pd.DataFrame.from_dict(self._old_instruments, orient="index")
+            _inst_df.index.names = [self.symbol_field_name]
+            self.save_instruments(_inst_df.reset_index())
+            logger.info("end of instruments dump.\n")
+            return
         _fun = partial(self._get_date, is_begin_end=True)
         new_stock_files = sorted(
             filter(
@@ -403,6 +695,7 @@ class DumpDataUpdate(DumpDataBase):
         exclude_fields: str = "",
         include_fields: str = "",
         limit_nums: int = None,
+        dataset: bool = False,
     ):
         """
 
@@ -413,7 +706,7 @@ class DumpDataUpdate(DumpDataBase):
         qlib_dir: str
             qlib(dump) data director
         backup_dir: str, default None
-            if backup_dir is not None, backup qlib_dir to backup_dir
+            if backup_dir is not None, backup qlib_dir to backup_dir (a hardlink snapshot, dumps never modify it)
         freq: str, default "day"
             transaction frequency
         max_workers: int, default None
@@ -430,6 +723,8 @@ class DumpDataUpdate(DumpDataBase):
             fields not dumped
         limit_nums: int
             Use when debugging, default None
+        dataset: bool, default False
+            data_path is a single multi-symbol Parquet dataset, see DumpDataBase
         """
         super().__init__(
             data_path,
@@ -442,6 +737,7 @@ class DumpDataUpdate(DumpDataBase):
             symbol_field_name,
             exclude_fields,
             include_fields,
+            dataset=dataset,
         )
         self._mode = self.UPDATE_MODE
         self._old_calendar_list = self._read_calendars(self._calendars_dir.joinpath(f"{self.freq}.txt"))
@@ -452,37 +748,93 @@ class DumpDataUpdate(DumpDataBase):
             .set_index([self.symbol_field_name])
             .to_dict(orient="index")
         )  # type: dict
+        # extended with the dates of the source data in dump()
+        self._new_calendar_list = self._old_calendar_list
+        self._old_calendar_end = self._old_calendar_list[-1]
+
+    def _get_update_ranges(self, df: pd.DataFrame, file_path: Path = None) -> list:
+        """[(code, begin, end, dates after the old calendar), ...] for the symbols in df"""
+        if df.empty or self.date_field_name not in df.columns:
+            return []
+        if self.symbol_field_name not in df.columns:
+            df[self.symbol_field_name] = self.get_symbol_from_file(file_path)
+        _last = self._old_calendar_end
+        ranges = []
+        for _code, _df in df.groupby(self.symbol_field_name):
+            _code = fname_to_code(str(_code).lower()).upper()
+            _start, _end = self._get_date(_df, is_begin_end=True)
+            if not (isinstance(_start, pd.Timestamp) and isinstance(_end, pd.Timestamp)):
+                continue
+            _dates = _df[self.date_field_name]
+            ranges.append((_code, _start, _end, set(_dates[_dates > _last])))
+        return ranges
 
-        # load all csv files
-        self._all_data = self._load_all_source_data()  # type: pd.DataFrame
-        self._new_calendar_list = self._old_calendar_list + sorted(
-            filter(lambda x: x > self._old_calendar_list[-1], self._all_data[self.date_field_name].unique())
-        )
-
-    def _load_all_source_data(self):
-        # NOTE: Need more memory
-        logger.info("start load all source data....")
-        all_df = []
-
-        def _read_df(file_path: Path):
-            _df = read_as_df(file_path)
-            if self.date_field_name in _df.columns and not np.issubdtype(
-                _df[self.date_field_name].dtype, np.datetime64
-            ):
-                _df[self.date_field_name] = pd.to_datetime(_df[self.date_field_name])
-            if self.symbol_field_name not in _df.columns:
-                _df[self.symbol_field_name] = self.get_symbol_from_file(file_path)
-            return _df
+    def _scan_file(self, file_path: Path) -> list:
+        df = self._get_source_data(file_path, columns=[self.date_field_name, self.symbol_field_name])
+        return self._get_update_ranges(df, file_path)
 
-        with tqdm(total=len(self.df_files)) as p_bar:
-            with ThreadPoolExecutor(max_workers=self.works) as executor:
-                for df in executor.map(_read_df, self.df_files):
-                    if not df.empty:
-                        all_df.append(df)
-                    p_bar.update()
+    def _scan_sources(self):
+        """
+        Read only the date and symbol columns of the source data.
+
+        Returns
+        -------
+        sources : dict
+            {source: {code: (begin, end)}}; source is a file path, or the raw symbol value in dataset mode
+        new_dates : set
+            dates after the old calendar
+        """
+        logger.info("start scan source data......")
+        sources, owner, new_dates = {}, {}, set()
+
+        def _collect(source, ranges):
+            for _code, _start, _end, _dates in ranges:
+                if _code in owner:
+                    raise ValueError(
+                        f"{_code} is found in both {owner[_code]} and {source}, merge them or use dataset=True"
+                    )
+                owner[_code] = source
+                sources.setdefault(source, {})[_code] = (_start, _end)
+                new_dates.update(_dates)
+
+        if self.dataset:
+            for df in tqdm(self._iter_dataset([])):
+                source = df[self.symbol_field_name].iloc[0]
+                _collect(source.item() if hasattr(source, "item") else source, self._get_update_ranges(df))
+        else:
+            with tqdm(total=len(self.df_files)) as p_bar:
+                with ProcessPoolExecutor(max_workers=self.works) as executor:
+                    for file_path, ranges in zip(self.df_files, executor.map(self._scan_file, self.df_files)):
+                        _collect(file_path, ranges)
+                        p_bar.update()
+        logger.info("end of scan source data.\n")
+        return sources, new_dates
+
+    def _read_source(self, source) -> pd.DataFrame:
+        if self.dataset:
+            return self._read_dataset_symbol(source, self._source_columns())
+        df = self._get_source_data(source, columns=self._source_columns())
+        if self.symbol_field_name not in df.columns:
+            df[self.symbol_field_name] = self.get_symbol_from_file(source)
+        return df
 
-        logger.info("end of load all data.\n")
-        return pd.concat(all_df, sort=False)
+    def _dump_update(self, source, ends: dict):
+        """
+        Read one source in the worker and dump its symbols: append the dates after ends[code] for existing stocks,
+        dump the whole range on the new calendar when ends[code] is None (new stock).
+        """
+        df = self._read_source(source)
+        for _code, _df in df.groupby(self.symbol_field_name, group_keys=False):
+            _code = fname_to_code(str(_code).lower()).upper()
+            if _code not in ends:
+                continue
+            if ends[_code] is None:
+                self._dump_bin(_df)
+            else:
+                _update_calendars = (
+                    _df[_df[self.date_field_name] > ends[_code]][self.date_field_name].sort_values().to_list()
+                )
+                self._dump_bin(_df, _update_calendars)
 
     def _dump_calendars(self):
         pass
@@ -490,49 +842,55 @@ class DumpDataUpdate(DumpDataBase):
     def _dump_instruments(self):
         pass
 
-    def _dump_features(self):
+    def _dump_features(self, sources: dict):
+        """
+        Sources are dumped one per task: the parent only submits the file path (or dataset symbol) and the end dates
+        to append after, each worker reads and writes its own data, and at most 2 * max_workers tasks are in flight.
+        """
         logger.info("start dump features......")
         error_code = {}
-        with ProcessPoolExecutor(max_workers=self.works) as executor:
+        with self._calendar_executor(self._new_calendar_list) as executor, tqdm() as p_bar:
             futures = {}
-            for _code, _df in self._all_data.groupby(self.symbol_field_name, group_keys=False):
-                _code = fname_to_code(str(_code).lower()).upper()
-                _start, _end = self._get_date(_df, is_begin_end=True)
-                if not (isinstance(_start, pd.Timestamp) and isinstance(_end, pd.Timestamp)):
-                    continue
-                if _code in self._update_instruments:
-                    # exists stock, will append data
-                    _update_calendars = (
-                        _df[_df[self.date_field_name] > self._update_instruments[_code][self.INSTRUMENTS_END_FIELD]][
-                            self.date_field_name
-                        ]
-                        .sort_values()
-                        .to_list()
-                    )
-                    if _update_calendars:
-                        self._update_instruments[_code][self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end)
-                        futures[executor.submit(self._dump_bin, _df, _update_calendars)] = _code
-                else:
-                    # new stock
-                    _dt_range = self._update_instruments.setdefault(_code, dict())
-                    _dt_range[self.INSTRUMENTS_START_FIELD] = self._format_datetime(_start)
-                    _dt_range[self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end)
-                    futures[executor.submit(self._dump_bin, _df, self._new_calendar_list)] = _code
-
-            with tqdm(total=len(futures)) as p_bar:
-                for _future in as_completed(futures):
+
+            def _collect(done):
+                for _future in done:
                     try:
                         _future.result()
                     except Exception:
                         error_code[futures[_future]] = traceback.format_exc()
+                    futures.pop(_future)
                     p_bar.update()
+
+            for source, ranges in sources.items():
+                ends = {}
+                for _code, (_start, _end) in ranges.items():
+                    if _code in self._update_instruments:
+                        # exists stock, will append data
+                        _old_end = pd.Timestamp(self._update_instruments[_code][self.INSTRUMENTS_END_FIELD])
+                        if _end > _old_end:
+                            self._update_instruments[_code][self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end)
+                            ends[_code] = _old_end
+                    else:
+                        # new stock
+                        _dt_range = self._update_instruments.setdefault(_code, dict())
+                        _dt_range[self.INSTRUMENTS_START_FIELD] = self._format_datetime(_start)
+                        _dt_range[self.INSTRUMENTS_END_FIELD] = self._format_datetime(_end)
+                        ends[_code] = None
+                if not ends:
+                    continue
+                futures[executor.submit(self._dump_update, source, ends)] = source
+                if len(futures) >= 2 * self.works:
+                    _collect(wait(list(futures), return_when=FIRST_COMPLETED)[0])
+            _collect(list(as_completed(list(futures))))
             logger.info(f"dump bin errors: {error_code}")
 
         logger.info("end of features dump.\n")
 
     def dump(self):
+        _sources, _new_dates = self._scan_sources()
+        self._new_calendar_list = self._old_calendar_list + sorted(_new_dates)
         self.save_calendars(self._new_calendar_list)
-        self._dump_features()
+        self._dump_features(_sources)
         df = pd.DataFrame.from_dict(self._update_instruments, orient="index")
         df.index.names = [self.symbol_field_name]
         self.save_instruments(df.reset_index())
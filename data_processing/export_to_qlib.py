@@ -1,228 +1,200 @@
 import pandas as pd
-from clickhouse_driver import Client
 from pathlib import Path
-import subprocess
-import requests
+import json
+import os
 import shutil
 import sys
 import time
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent))
+from infra.db import execute
+from infra.factors import FACTOR_TABLE, refresh_factors
+from infra.panel import iter_symbols, load_panel
+from qlib_writer import QlibBinWriter, publish_dir, stage_dir
+
 # Config
-CLICKHOUSE_HOST = "..."
-CLICKHOUSE_DB = "stock_data"
-
-EXPORT_DIR = Path("qlib_data/cn_data") # Qlib 数据存储位置
-CSV_TEMP_DIR = Path("qlib_data/csv_temp") # 临时 CSV 存放目录
-
-DUMP_SCRIPT_URL = "https://raw.githubusercontent.com/microsoft/qlib/main/scripts/dump_bin.py"
-DUMP_SCRIPT_PATH = Path("dump_bin.py")
-
-
-def download_dump_script(force: bool = True) -> None:
-    """更新 dump_bin.py 并自动打补丁以适配 macOS"""
-    if not DUMP_SCRIPT_PATH.exists() or force:
-        print(f"正在下载/更新 Qlib 数据转换脚本: {DUMP_SCRIPT_URL}")
-        try:
-            resp = requests.get(DUMP_SCRIPT_URL, timeout=20)
-            resp.raise_for_status()
-            DUMP_SCRIPT_PATH.write_bytes(resp.content)
-            print("dump_bin.py 下载/更新成功")
-        except Exception as e:
-            if DUMP_SCRIPT_PATH.exists():
-                print(f"下载失败: {e}，使用本地缓存副本。")
-            else:
-                raise RuntimeError(f"dump_bin.py 下载失败: {e}") from e
+EXPORT_DIR = Path("qlib_data/cn_data") # Qlib 数据存储位置 (指向当前版本的符号链接, 见 qlib_writer.publish_dir)
+# 增量导出时重写最近 N 个交易日 (接收晚到的情绪/因子数据), 更早的历史有变化时才全量重建
+EXPORT_REFRESH_DAYS = int(os.getenv("QLIB_EXPORT_REFRESH_DAYS", "5"))
+EXPORT_STATE_NAME = "export_state.json"
+# 这些表的 updated_at (见 infra/schema.py) 作为水位线: 刷新窗口之前的行在上次导出后被写过, 说明历史变了
+WATERMARK_TABLES = ['stock_daily', FACTOR_TABLE]
+
+# 导出的数值列 (列裁剪: 只查询这些列) 及其 SQL 表达式
+EXPORT_VALUES = {
+    'open': 't1.open',
+    'close': 't1.close',
+    'high': 't1.high',
+    'low': 't1.low',
+    'volume': 't1.vol',
+    'amount': 't1.amount',
+    # 使用 ifNull 防止空值报错
+    'turnover': 'ifNull(t1.turnover_rate, 0)',
+    # 新闻情绪 / 板块得分 / 最终合成Alpha, 来自预聚合的因子表 (infra/factors.py)
+    'sentiment': 'ifNull(f.sentiment, 0)',
+    'sector_score': 'ifNull(f.sector_score, 0)',
+    'total_score': 'ifNull(f.total_score, 0)',
+}
+EXPORT_FIELDS = list(EXPORT_VALUES)
+QLIB_FIELDS = EXPORT_FIELDS + ['factor']
+
+
+def export_source(factor_filter):
+    """
+    两张表都是 ReplacingMergeTree, FINAL 只保留每个主键最新版本的一行 (重跑写入的旧版本不会重复计入).
+    factor_filter 把因子表子查询限定在与外层查询相同的范围 (日期段或代码段), 每次只扫描需要的部分.
+    """
+    return f"""
+    stock_daily AS t1 FINAL
+    LEFT JOIN (
+        SELECT ts_code, trade_date, sentiment, sector_score, total_score
+        FROM {FACTOR_TABLE} FINAL
+        WHERE {factor_filter}
+    ) f ON t1.ts_code = f.ts_code AND t1.trade_date = f.trade_date
+    """
+
 
+def load_export_state(qlib_dir=EXPORT_DIR):
     try:
-        content = DUMP_SCRIPT_PATH.read_text(encoding='utf-8')
-        if ".iterdir()" in content:
-            print("检测到原始脚本, 正在应用 macOS 兼容性补丁...")
-            new_content = content.replace(".iterdir()", ".glob('*.csv')")
-            DUMP_SCRIPT_PATH.write_text(new_content, encoding='utf-8')
-        elif ".glob('*.csv')" in content:
-            print("脚本已包含 macOS 兼容性补丁.")
+        return json.loads((qlib_dir / EXPORT_STATE_NAME).read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_export_state(state, qlib_dir=EXPORT_DIR):
+    """状态文件和数据放在同一个版本目录里, 随数据一起发布"""
+    path = qlib_dir / EXPORT_STATE_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding='utf-8')
+    tmp.replace(path)
+
+
+def history_changed(cutoff, since):
+    """cutoff 之前的行在 since (服务器时间) 之后被重写或补写过时, 返回对应的表名, 否则返回 None"""
+    for table in WATERMARK_TABLES:
+        count = execute(
+            f"SELECT count() FROM {table} WHERE trade_date < %(cutoff)s AND updated_at > toDateTime64(%(since)s, 3)",
+            {'cutoff': cutoff, 'since': since},
+        )[0][0]
+        if count:
+            return table
+    return None
+
+
+def plan_incremental(writer, state):
+    """
+    返回 (keep_until, reason): keep_until 为保留的旧日历天数 (之后的部分重新导出), 为 None 时需要全量重建, reason 说明原因.
+    """
+    calendar = writer.read_calendar()
+    if state is None or calendar is None or len(calendar) == 0:
+        return None, "没有上次导出的记录"
+    if state.get('fields') != QLIB_FIELDS:
+        return None, "导出字段有变化"
+    keep_until = len(calendar) - EXPORT_REFRESH_DAYS
+    if keep_until <= 0:
+        return None, "已有日历短于刷新窗口"
+    try:
+        table = history_changed(calendar[keep_until].date(), state['exported_at'])
     except Exception as e:
-        print(f"应用补丁失败 (非致命错误): {e}")
-
-
-def hard_reset_dir(dir_path: Path) -> None:
-    """强制重建目录"""
-    if dir_path.exists():
-        try:
-            shutil.rmtree(dir_path)
-        except Exception as e:
-            print(f"删除目录失败: {dir_path} ({e})，尝试忽略并继续")
-    dir_path.mkdir(parents=True, exist_ok=True)
-
-
-def sanitize_csv_temp_dir(dir_path: Path) -> None:
-    """删除所有非 CSV 的文件/目录"""
-    if not dir_path.exists():
-        return
-    removed = 0
-    for p in list(dir_path.iterdir()):
-        try:
-            if p.is_dir():
-                shutil.rmtree(p, ignore_errors=True)
-                removed += 1
-            elif p.is_file() and p.suffix.lower() != ".csv":
-                p.unlink(missing_ok=True)
-                removed += 1
-        except Exception as e:
-            pass
-    if removed > 0:
-        print(f"已清理 csv_temp 中 {removed} 个非 CSV 项")
-
-
-def export_clickhouse_to_qlib():
-    # 0) 更新 dump_bin.py
-    download_dump_script(force=False)
-
-    # 1) 读 ClickHouse
-    client = Client(host=CLICKHOUSE_HOST, database=CLICKHOUSE_DB, settings={"use_numpy": True})
-
-    print("正在从 ClickHouse 读取全量数据...")
-    
-    sql = """
-    SELECT
-        t1.ts_code    AS ts_code,
-        t1.trade_date AS trade_date,
-        t1.open       AS open, 
-        t1.close      AS close, 
-        t1.high       AS high, 
-        t1.low        AS low, 
-        t1.vol        AS volume, 
-        t1.amount     AS amount,
-        
-        -- 使用 ifNull 防止空值报错
-        ifNull(t1.turnover_rate, 0) AS turnover,
-
-        -- 1. 新闻情绪 (Sentiment)
-        ifNull(t_sent.avg_score, 0)   AS sentiment,
-        
-        -- 2. 板块得分 (Sector Score)
-        ifNull(t_sector.alpha_score, 0) AS sector_score,
-        
-        -- 3. 最终合成Alpha (Total Alpha)
-        ifNull(t_alpha.alpha_score, 0)  AS total_score
-
-    FROM stock_daily t1
-    
-    -- 关联新闻表
-    LEFT JOIN (
-        SELECT ts_code, trade_date, avg(score) as avg_score
-        FROM stock_news_sentiment
-        GROUP BY ts_code, trade_date
-    ) t_sent ON t1.ts_code = t_sent.ts_code AND t1.trade_date = t_sent.trade_date
-    
-    -- 关联板块轮动因子
-    LEFT JOIN (
-        SELECT ts_code, trade_date, alpha_score
-        FROM stock_daily_alpha
-        WHERE strategy_name = 'sector_rotation_v1'
-    ) t_sector ON t1.ts_code = t_sector.ts_code AND t1.trade_date = t_sector.trade_date
-    
-    -- 关联最终合成因子
-    LEFT JOIN (
-        SELECT ts_code, trade_date, alpha_score
-        FROM stock_daily_alpha
-        WHERE strategy_name = 'multi_factor_v1'
-    ) t_alpha ON t1.ts_code = t_alpha.ts_code AND t1.trade_date = t_alpha.trade_date
-    
-    ORDER BY t1.trade_date ASC
+        # 旧的 MergeTree 表没有 updated_at 列, 无法判断
+        return None, f"无法读取水位线 ({e})"
+    if table is not None:
+        return None, f"{table} 中 {calendar[keep_until].date()} 之前的数据有变化"
+    return keep_until, None
+
+
+def export_full(writer):
+    """
+    按 (ts_code, trade_date) 顺序分批流式读取, 每只股票读完立即交给写入线程,
+    内存里只有一批股票的数据 (float32, Qlib 的 .bin 本身就是 float32, 不损失精度).
     """
+    calendar = pd.DatetimeIndex(pd.to_datetime(
+        [r[0] for r in execute("SELECT DISTINCT trade_date FROM stock_daily ORDER BY trade_date")]))
+    symbols = [r[0] for r in execute("SELECT DISTINCT ts_code FROM stock_daily ORDER BY ts_code")]
+    print(f"正在从 ClickHouse 流式读取全量数据: {len(symbols)} 只股票, {len(calendar)} 个交易日...")
+
+    # 直接写 Qlib 二进制: 日历/股票列表取自查询结果, 各股票的 features/<symbol>/<field>.day.bin 并行写出
+    items = iter_symbols(export_source("ts_code >= %(lo)s AND ts_code <= %(hi)s"), EXPORT_VALUES, symbols, calendar,
+                         symbol='t1.ts_code', date_col='t1.trade_date')
+    print(f"正在写入 Qlib 二进制 ({writer.max_workers} 线程)...")
+    n_symbols = writer.write_stream(calendar, items, constants={'factor': 1.0})
+    print(f"全量导出完成. {n_symbols} 只股票, {len(calendar)} 个交易日")
 
-    df = client.query_dataframe(sql)
-    print(f"读取完成！共 {len(df)} 行数据。")
-    
-    # 2) 规范字段
-    try:
-        df["date"] = pd.to_datetime(df["trade_date"])
-    except KeyError:
-        # 兼容性处理
-        for col in df.columns:
-            if "trade_date" in col:
-                df["trade_date"] = df[col]
-                df["date"] = pd.to_datetime(df["trade_date"])
-                break
-        else:
-            raise KeyError("无法找到 trade_date 列")
-
-    if "ts_code" not in df.columns:
-        for col in df.columns:
-            if "ts_code" in col:
-                df["ts_code"] = df[col]
-                break
-
-    df["symbol"] = df["ts_code"]
-    df["volume"] = df["volume"].astype(float)
-    df["factor"] = 1.0
-    
-    # 确保 turnover 是 float 类型
-    if "turnover" in df.columns:
-        df["turnover"] = df["turnover"].astype(float)
-    else:
-        print("警告：结果中没有找到 turnover 列, 将使用全0填充")
-        df["turnover"] = 0.0
-
-    # 3) 清理并生成 CSV
-    print("正在重建临时目录...")
-    hard_reset_dir(CSV_TEMP_DIR)
-
-    print("正在生成临时 CSV 文件 (按股票拆分)...")
-    
-    cols_to_write = ["date", "open", "close", "high", "low", "volume", "amount", "factor", 
-                     "turnover", "sentiment", "sector_score", "total_score"]
-
-    grouped = df.groupby("symbol", observed=False)
-    total = grouped.ngroups
-    count = 0
-
-    for symbol, g in grouped:
-        symbol = str(symbol)
-        safe_symbol = symbol.replace("/", "_").replace("\\", "_").strip()
-        file_path = CSV_TEMP_DIR / f"{safe_symbol}.csv"
-
-        g.to_csv(
-            file_path,
-            index=False,
-            columns=cols_to_write,
-            date_format="%Y-%m-%d",
-        )
-
-        count += 1
-        if count % 1000 == 0:
-            print(f" 已处理 {count}/{total} 只股票...")
-
-    # 4) 二次清理
-    sanitize_csv_temp_dir(CSV_TEMP_DIR)
-
-    print("CSV 准备就绪，开始调用 Qlib 转换脚本...")
-
-    # 5) 调用 dump_bin.py
-    EXPORT_DIR.parent.mkdir(parents=True, exist_ok=True)
-
-    cmd = [
-        sys.executable, str(DUMP_SCRIPT_PATH),
-        "dump_all",
-        "--data_path", str(CSV_TEMP_DIR),
-        "--qlib_dir", str(EXPORT_DIR),
-        "--include_fields", "open,close,high,low,volume,amount,factor,turnover,sentiment,sector_score,total_score",
-        "--date_field_name", "date",
-        "--symbol_field_name", "symbol",
-        "--file_suffix", ".csv",
-    ]
-
-    print(f"执行命令: {' '.join(cmd)}")
 
+def export_incremental(writer, keep_until):
+    """
+    只读取刷新窗口 (旧日历第 keep_until 天) 之后的数据, 就地更新已有 .bin 并追加新交易日.
+    窗口内的数据与已导出的结构不一致 (旧交易日消失, 股票从窗口内消失, 缺少字段文件) 时返回 False, 由调用方全量重建.
+    """
+    calendar = writer.read_calendar()
+    cutoff = calendar[keep_until]
+    print(f"增量导出: 已导出至 {calendar[-1].date()}, 重新读取 {cutoff.date()} 之后的数据...")
+    # 刷新窗口只有几天, 按日期读成紧凑的 Panel 即可
+    panel = load_panel(export_source("trade_date >= %(start)s AND trade_date < %(end)s"), EXPORT_VALUES,
+                       symbol='t1.ts_code', date_col='t1.trade_date', start=cutoff.date())
+    print(f"读取完成！共 {len(panel)} 行数据, 内存占用 {panel.memory_mb():.1f} MB。")
+
+    window = calendar[keep_until:]
+    if not panel.calendar[:len(window)].equals(window.rename(panel.calendar.name)):
+        print("刷新窗口内的交易日与已导出的日历不一致")
+        return False
+    ranges = writer.read_instruments()
+    present = {str(s).upper() for s in panel.symbols}
+    dropped = [s for s, (_, end) in ranges.items() if end >= cutoff and s not in present]
+    if dropped:
+        print(f"{len(dropped)} 只股票在刷新窗口内的数据消失 (如 {dropped[0]})")
+        return False
+    missing = [s for s in panel.symbols if str(s).upper() in ranges and not writer.has_fields(s, QLIB_FIELDS)]
+    if missing:
+        print(f"{len(missing)} 只股票缺少字段文件 (如 {missing[0]})")
+        return False
+
+    new_days = len(panel.calendar) - len(window)
+    print(f"正在更新 Qlib 二进制 ({writer.max_workers} 线程)...")
+    n_symbols = writer.update_panel(panel, EXPORT_FIELDS, keep_until, constants={'factor': 1.0})
+    print(f"增量导出完成. 更新 {n_symbols} 只股票, 新增 {new_days} 个交易日")
+    return True
+
+
+def export_clickhouse_to_qlib(full=False):
+    """
+    默认增量导出; full=True, 或者没有上次导出记录 / 刷新窗口之前的历史有变化时, 全量重建.
+    写入都在 staging 目录 (增量时是当前版本的硬链接快照) 里进行, 成功后才原子发布; 中途失败时已发布的数据不受影响.
+    """
+    started = time.monotonic()
+    # 先把情绪/策略信号的新数据合并进因子表 (没有变化时只有一次很小的查询)
+    refresh_factors()
+    # 水位线取读数据之前的服务器时间: 导出过程中写入的行下次一定会被检查到
+    exported_at = execute("SELECT toString(now64(3))")[0][0]
+
+    state = load_export_state()
+    staging = stage_dir(EXPORT_DIR, empty=full)
     try:
-        subprocess.run(cmd, check=True)
-        print(f"\n转换完成. Qlib 数据已更新至: {EXPORT_DIR.resolve()}")
-    except subprocess.CalledProcessError as e:
-        print(f"\n转换失败: {e}")
-        print("请检查控制台输出的错误信息.")
+        writer = QlibBinWriter(staging)
+        keep_until, reason = (None, "指定了全量导出") if full else plan_incremental(writer, state)
+        mode = 'incremental'
+        if keep_until is None or not export_incremental(writer, keep_until):
+            print(f"全量重建: {reason or '增量检查未通过'}")
+            if not full:
+                # 全量重建不需要快照里的旧文件 (已经不存在的股票也不应保留)
+                shutil.rmtree(staging)
+                staging = stage_dir(EXPORT_DIR, empty=True)
+                writer = QlibBinWriter(staging)
+            export_full(writer)
+            mode = 'full'
+
+        calendar = writer.read_calendar()
+        save_export_state({'exported_at': exported_at, 'mode': mode, 'fields': QLIB_FIELDS,
+                           'last_date': calendar[-1].strftime("%Y-%m-%d") if len(calendar) else None}, staging)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
         raise
+    publish_dir(staging, EXPORT_DIR)
+    print(f"耗时 {time.monotonic() - started:.1f}s. Qlib 数据已更新至: {EXPORT_DIR.resolve()}")
 
 
 if __name__ == "__main__":
-    export_clickhouse_to_qlib()
+    # 强制全量: python data_processing/export_to_qlib.py --full
+    export_clickhouse_to_qlib(full="--full" in sys.argv[1:] or os.getenv("QLIB_EXPORT_FULL", "0") == "1")
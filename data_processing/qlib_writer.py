@@ -0,0 +1,269 @@
+import os
+import re
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from qlib.utils import code_to_fname
+
+# 与 dump_bin.py 相同的目录结构和文件格式:
+#   calendars/day.txt                  每行一个交易日
+#   instruments/all.txt                SYMBOL\tstart\tend
+#   features/<symbol>/<field>.day.bin  little-endian float32, 第一个数是起始日在日历中的下标, 之后逐日取值
+WRITE_WORKERS = int(os.getenv("QLIB_WRITE_WORKERS", "8"))
+# 发布方式: qlib_dir 是指向同级版本目录 .<name>.<时间戳>.<pid> 的符号链接. 写入都在新的版本目录 (staging) 里完成,
+# 最后原子地替换符号链接; 读取端 (backtest.py / predict_tomorrow.py) 只会看到完整的旧版本或新版本.
+# 读取端 resolve() 之后会固定在某个版本上, 所以旧版本保留几份再删
+KEEP_VERSIONS = int(os.getenv("QLIB_KEEP_VERSIONS", "2"))
+
+
+def _version_stamp():
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+
+def snapshot_dir(src, dst):
+    """硬链接快照: 只复制目录结构, 文件建硬链接, 近乎瞬时且不占额外空间. 快照中的文件不能就地修改, 见 detach_file"""
+    shutil.copytree(str(src), str(dst), copy_function=os.link)
+
+
+def detach_file(path, keep=True):
+    """
+    修改 path 之前调用: 文件与快照/已发布的版本共享 inode 时先断开,
+    keep=True 换成内容相同的独立副本 (之后追加/截断), keep=False 直接删除 (之后整体重写).
+    """
+    try:
+        if os.stat(path).st_nlink <= 1:
+            return
+    except FileNotFoundError:
+        return
+    if keep:
+        tmp = f"{path}.detach"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, path)
+    else:
+        os.unlink(path)
+
+
+def stage_dir(qlib_dir, empty=False):
+    """在 qlib_dir 旁边新建版本目录: 默认是当前数据的硬链接快照 (在其上增量更新), empty=True 时为空目录 (全量重建)"""
+    qlib_dir = Path(qlib_dir).expanduser()
+    staging = qlib_dir.parent / f".{qlib_dir.name}.{_version_stamp()}.{os.getpid()}"
+    if qlib_dir.exists() and not empty:
+        snapshot_dir(qlib_dir.resolve(), staging)
+    else:
+        staging.mkdir(parents=True)
+    return staging
+
+
+def publish_dir(staging, qlib_dir, keep=KEEP_VERSIONS):
+    """
+    把 staging 原子地发布为 qlib_dir (os.replace 替换符号链接), 然后只保留最近 keep 个旧版本.
+    qlib_dir 还是普通目录时 (第一次发布) 先把它改名为一个旧版本, 两次 rename 之间 qlib_dir 短暂不存在, 但不会是半成品.
+    同一个 qlib_dir 同时只能有一个写入方.
+    """
+    qlib_dir, staging = Path(qlib_dir).expanduser(), Path(staging)
+    link = qlib_dir.parent / f".{qlib_dir.name}.link.{os.getpid()}"
+    os.symlink(staging.name, link)
+    if qlib_dir.exists() and not qlib_dir.is_symlink():
+        os.rename(qlib_dir, qlib_dir.parent / f".{qlib_dir.name}.{_version_stamp()}.legacy")
+    os.replace(link, qlib_dir)
+
+    version = re.compile(rf"\.{re.escape(qlib_dir.name)}\.\d{{20}}\.(\d+|legacy)")
+    old = [p for p in qlib_dir.parent.iterdir()
+           if version.fullmatch(p.name) and p.is_dir() and not p.is_symlink() and p.name != staging.name]
+    # 目录名里的时间戳即创建顺序 (copytree 会复制 mtime, 不能按 mtime 排)
+    for path in sorted(old, key=lambda p: p.name, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class QlibBinWriter:
+    """
+    进程内直接把 numpy 数组写成 Qlib 的 .bin, 不经过 CSV.
+    对齐规则与 dump_bin.py dump_all 一致: 每只股票从自己的首个交易日到最后一个交易日按日历连续存储, 缺失日为 NaN.
+    """
+
+    CALENDARS_DIR_NAME = "calendars"
+    FEATURES_DIR_NAME = "features"
+    INSTRUMENTS_DIR_NAME = "instruments"
+    INSTRUMENTS_FILE_NAME = "all.txt"
+    INSTRUMENTS_SEP = "\t"
+    DUMP_FILE_SUFFIX = ".bin"
+    DAILY_FORMAT = "%Y-%m-%d"
+
+    def __init__(self, qlib_dir, freq="day", max_workers=WRITE_WORKERS):
+        self.qlib_dir = Path(qlib_dir).expanduser()
+        self.freq = freq
+        self.max_workers = max_workers
+
+    @property
+    def calendar_path(self):
+        return self.qlib_dir / self.CALENDARS_DIR_NAME / f"{self.freq}.txt"
+
+    @property
+    def instruments_path(self):
+        return self.qlib_dir / self.INSTRUMENTS_DIR_NAME / self.INSTRUMENTS_FILE_NAME
+
+    def features_dir(self, symbol):
+        return self.qlib_dir / self.FEATURES_DIR_NAME / code_to_fname(str(symbol)).lower()
+
+    def write_calendar(self, calendar):
+        self.calendar_path.parent.mkdir(parents=True, exist_ok=True)
+        detach_file(self.calendar_path, keep=False)
+        lines = [d.strftime(self.DAILY_FORMAT) for d in calendar]
+        self.calendar_path.write_text("".join(f"{d}\n" for d in lines), encoding="utf-8")
+
+    def write_instruments(self, ranges):
+        """ranges: [(symbol, start, end), ...], start/end 为 Timestamp"""
+        self.instruments_path.parent.mkdir(parents=True, exist_ok=True)
+        detach_file(self.instruments_path, keep=False)
+        lines = [
+            self.INSTRUMENTS_SEP.join([str(s).upper(), a.strftime(self.DAILY_FORMAT), b.strftime(self.DAILY_FORMAT)])
+            for s, a, b in ranges
+        ]
+        self.instruments_path.write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+
+    def write_symbol(self, symbol, days, fields):
+        """
+        days: 升序且不重复的日历下标 (int); fields: {字段名: 与 days 等长的数组}.
+        返回 (首日下标, 末日下标).
+        """
+        first, last = int(days[0]), int(days[-1])
+        offsets = days - first
+        out_dir = self.features_dir(symbol)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        buf = np.empty(last - first + 2, dtype="<f")
+        for field, values in fields.items():
+            buf[0] = first
+            buf[1:] = np.nan
+            buf[1:][offsets] = values
+            path = out_dir / f"{field.lower()}.{self.freq}{self.DUMP_FILE_SUFFIX}"
+            detach_file(path, keep=False)
+            buf.tofile(str(path))
+        return first, last
+
+    def read_calendar(self):
+        """已有的日历 (DatetimeIndex), 文件不存在时返回 None"""
+        if not self.calendar_path.exists():
+            return None
+        lines = self.calendar_path.read_text(encoding="utf-8").split()
+        return pd.DatetimeIndex(pd.to_datetime(lines), name="trade_date")
+
+    def read_instruments(self):
+        """{SYMBOL: (start, end)}, 文件不存在时返回空 dict"""
+        if not self.instruments_path.exists():
+            return {}
+        ranges = {}
+        for line in self.instruments_path.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                symbol, start, end = line.split(self.INSTRUMENTS_SEP)
+                ranges[symbol] = (pd.Timestamp(start), pd.Timestamp(end))
+        return ranges
+
+    def has_fields(self, symbol, fields):
+        out_dir = self.features_dir(symbol)
+        return all((out_dir / f"{f.lower()}.{self.freq}{self.DUMP_FILE_SUFFIX}").exists() for f in fields)
+
+    def update_symbol(self, symbol, days, fields, keep_until):
+        """
+        就地更新已有的 .bin (dump_bin.py DumpDataUpdate 的追加语义, 外加重写最近几天):
+        保留日历下标 < keep_until 的已有取值, 从 keep_until 起用 days/fields 重写并追加, 中间缺失的交易日补 NaN.
+        days 为全局日历下标 (均 >= keep_until). 该股票的起始日不早于 keep_until 时整段重写.
+        返回 (首日下标, 末日下标).
+        """
+        out_dir = self.features_dir(symbol)
+        paths = {f: out_dir / f"{f.lower()}.{self.freq}{self.DUMP_FILE_SUFFIX}" for f in fields}
+        # 同一只股票的各字段起始日相同, 读第一个文件的头即可
+        first = int(np.fromfile(str(next(iter(paths.values()))), dtype="<f", count=1)[0])
+        if first >= keep_until:
+            return self.write_symbol(symbol, days, fields)
+
+        last = int(days[-1])
+        for field, values in fields.items():
+            path = paths[field]
+            kept = min(path.stat().st_size // 4 - 1, keep_until - first)
+            tail = np.full(last - first + 1 - kept, np.nan, dtype="<f")
+            tail[days - first - kept] = values
+            detach_file(path)
+            with open(path, "r+b") as fp:
+                fp.truncate(4 * (1 + kept))
+                fp.seek(0, 2)
+                tail.tofile(fp)
+        return first, last
+
+    def _write_symbols(self, panel, fields, constants, write, day_offset=0):
+        """按股票切分 panel 并用线程池调用 write(symbol, days, fields), 返回 [(symbol, 首日下标, 末日下标), ...]"""
+        frame = panel.frame
+        codes = frame[panel.symbol].cat.codes.to_numpy()
+        days = frame["day"].to_numpy().astype(np.int64) + day_offset
+        order = np.lexsort((days, codes))
+        codes, days = codes[order], days[order]
+        columns = {f: frame[f].to_numpy()[order] for f in fields}
+        bounds = np.flatnonzero(np.diff(codes)) + 1
+        starts = np.concatenate([[0], bounds]).astype(np.int64)
+        ends = np.concatenate([bounds, [len(codes)]]).astype(np.int64)
+        symbols = panel.symbols
+
+        def _write(i):
+            lo, hi = starts[i], ends[i]
+            sym_fields = {f: col[lo:hi] for f, col in columns.items()}
+            for name, value in (constants or {}).items():
+                sym_fields[name] = np.full(hi - lo, value, dtype="<f")
+            return write(symbols[codes[lo]], days[lo:hi], sym_fields)
+
+        if not len(codes):
+            return []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return [(symbols[codes[starts[i]]], first, last)
+                    for i, (first, last) in enumerate(executor.map(_write, range(len(starts))))]
+
+    def write_stream(self, calendar, items, constants=None):
+        """
+        全量写出: items 逐只产出 (代码, 日历下标数组, {字段: 数组}) (如 infra.panel.iter_symbols), 边读边写.
+        constants: 额外的常数字段 (如 {'factor': 1.0}), 只在有数据的交易日取该值.
+        股票之间互不依赖, 用线程池并行写 (numpy 写文件时释放 GIL); 在途的股票不超过 2 * max_workers 只, 内存有上界.
+        返回写入的股票数.
+        """
+        self.write_calendar(calendar)
+        ranges = []
+        pending = deque()
+
+        def _drain(limit):
+            while len(pending) > limit:
+                symbol, future = pending.popleft()
+                first, last = future.result()
+                ranges.append((symbol, calendar[first], calendar[last]))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for symbol, days, fields in items:
+                for name, value in (constants or {}).items():
+                    fields[name] = np.full(len(days), value, dtype="<f")
+                pending.append((symbol, executor.submit(self.write_symbol, symbol, days, fields)))
+                _drain(2 * self.max_workers)
+            _drain(0)
+        self.write_instruments(ranges)
+        return len(ranges)
+
+    def update_panel(self, panel, fields, keep_until, constants=None):
+        """
+        增量写出: panel 只包含日历下标 >= keep_until 的数据, panel.calendar 接在旧日历的前 keep_until 天之后.
+        已有股票就地更新 (update_symbol), 新股票整段写出; 没有出现在 panel 里的股票保持不变.
+        返回本次写入的股票数.
+        """
+        calendar = self.read_calendar()[:keep_until].append(panel.calendar)
+        ranges = self.read_instruments()
+
+        def _write(symbol, days, sym_fields):
+            if str(symbol).upper() in ranges:
+                return self.update_symbol(symbol, days, sym_fields, keep_until)
+            return self.write_symbol(symbol, days, sym_fields)
+
+        written = self._write_symbols(panel, fields, constants, _write, day_offset=keep_until)
+        for symbol, first, last in written:
+            ranges[str(symbol).upper()] = (calendar[first], calendar[last])
+        self.write_calendar(calendar)
+        self.write_instruments([(s, a, b) for s, (a, b) in sorted(ranges.items())])
+        return len(written)
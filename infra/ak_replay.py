@@ -0,0 +1,146 @@
+import atexit
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from pathlib import Path
+
+# AkShare 录制/回放:
+#   AK_MODE=live   直接请求东财 (默认)
+#   AK_MODE=record 请求东财, 同时把返回的 DataFrame 存到 AK_FIXTURE_DIR
+#   AK_MODE=replay 不联网, 从 AK_FIXTURE_DIR 读取录制结果, 可注入延迟和错误率, 用于离线压测
+AK_MODE = os.getenv("AK_MODE", "live").lower()
+AK_FIXTURE_DIR = Path(os.getenv(
+    "AK_FIXTURE_DIR",
+    Path(__file__).resolve().parent.parent / ".cache" / "ak_fixtures",
+))
+# 回放延迟 (秒): "0.5" 表示固定 0.5 秒, "0.2,1.5" 表示在区间内均匀随机
+AK_REPLAY_LATENCY = os.getenv("AK_REPLAY_LATENCY", "0")
+AK_REPLAY_ERROR_RATE = float(os.getenv("AK_REPLAY_ERROR_RATE", "0"))
+AK_REPLAY_SEED = os.getenv("AK_REPLAY_SEED")
+# 这些参数随运行日期变化, 不参与 fixture 匹配 (否则换一天回放就找不到录制结果)
+AK_IGNORE_PARAMS = {p.strip() for p in os.getenv("AK_IGNORE_PARAMS", "start_date,end_date").split(",") if p.strip()}
+
+
+class ReplayMiss(LookupError):
+    """回放模式下没有找到对应的录制结果"""
+
+
+class InjectedError(ConnectionError):
+    """回放模式按 AK_REPLAY_ERROR_RATE 注入的模拟网络错误"""
+
+
+def _parse_latency(spec):
+    parts = [float(p) for p in str(spec).split(",") if p.strip()]
+    if not parts:
+        return 0.0, 0.0
+    return parts[0], parts[-1]
+
+
+def fixture_key(func_name, args, kwargs):
+    params = {k: v for k, v in kwargs.items() if k not in AK_IGNORE_PARAMS}
+    payload = json.dumps([list(args), params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class AkShareProxy:
+    """
+    替代 `import akshare as ak` 的代理对象, 调用方式完全相同 (ak.stock_zh_a_spot_em() ...).
+    每个接口的调用次数和耗时记录在 stats 里, 方便对比优化前后的请求量.
+    """
+
+    def __init__(self, mode=AK_MODE, fixture_dir=AK_FIXTURE_DIR, latency=AK_REPLAY_LATENCY,
+                 error_rate=AK_REPLAY_ERROR_RATE, seed=AK_REPLAY_SEED):
+        if mode not in ("live", "record", "replay"):
+            raise ValueError(f"unknown AK_MODE: {mode}")
+        self.mode = mode
+        self.fixture_dir = Path(fixture_dir)
+        self.latency = _parse_latency(latency)
+        self.error_rate = float(error_rate)
+        self.stats = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._module = None
+
+    @property
+    def module(self):
+        # 回放模式下不 import akshare, 没装 akshare 的机器也能跑
+        if self._module is None:
+            self._module = importlib.import_module("akshare")
+        return self._module
+
+    def _path(self, func_name, args, kwargs):
+        return self.fixture_dir / func_name / f"{fixture_key(func_name, args, kwargs)}.pkl"
+
+    def _record(self, path, result):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _replay(self, func_name, path):
+        with self._lock:
+            delay = self._rng.uniform(*self.latency)
+            fail = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise InjectedError(f"injected failure for {func_name}")
+        if not path.exists():
+            raise ReplayMiss(f"no fixture for {func_name} at {path}")
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _track(self, func_name, elapsed, ok):
+        with self._lock:
+            s = self.stats.setdefault(func_name, {'calls': 0, 'errors': 0, 'seconds': 0.0})
+            s['calls'] += 1
+            s['seconds'] += elapsed
+            if not ok:
+                s['errors'] += 1
+
+    def _wrap(self, func_name):
+        def call(*args, **kwargs):
+            path = self._path(func_name, args, kwargs)
+            started = time.perf_counter()
+            ok = False
+            try:
+                if self.mode == "replay":
+                    result = self._replay(func_name, path)
+                else:
+                    result = getattr(self.module, func_name)(*args, **kwargs)
+                    if self.mode == "record" and result is not None:
+                        self._record(path, result)
+                ok = True
+                return result
+            finally:
+                self._track(func_name, time.perf_counter() - started, ok)
+
+        call.__name__ = func_name
+        return call
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._wrap(name)
+
+    def report(self):
+        if not self.stats:
+            return
+        print(f"[ak_replay] mode={self.mode} 接口调用统计:")
+        for name, s in sorted(self.stats.items()):
+            print(f"  {name}: {s['calls']} 次, 失败 {s['errors']} 次, 共 {s['seconds']:.2f}s")
+
+
+ak = AkShareProxy()
+
+
+@atexit.register
+def _report_on_exit():
+    if ak.mode != "live":
+        ak.report()
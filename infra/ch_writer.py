@@ -0,0 +1,106 @@
+import atexit
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+# 进程退出时需要 flush 的 writer (弱引用, 不阻止回收)
+_LIVE_WRITERS = weakref.WeakSet()
+
+
+class BufferedInserter:
+    """
+    ClickHouse 批量写入缓冲区.
+    把多次小 DataFrame 攒成一个大的列式块再 insert, 避免每次写入都生成一个新的 MergeTree part.
+    行数达到 max_rows 或距上次 flush 超过 max_seconds 时自动落盘;
+    with 语句退出 / close() / 进程正常退出时都会把剩余数据写完.
+    """
+
+    def __init__(self, client, table, columns, max_rows=500000, max_seconds=60.0, settings=None):
+        self.client = client
+        self.table = table
+        self.columns = list(columns)
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        # 一个大块可能横跨很多月份分区, 默认上限 100 不够用
+        self.settings = {'max_partitions_per_insert_block': 2000}
+        if settings:
+            self.settings.update(settings)
+
+        self.total_rows = 0
+        self.flush_count = 0
+        self._frames = []
+        self._buffered_rows = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self._closed = False
+        _LIVE_WRITERS.add(self)
+
+    @property
+    def insert_sql(self):
+        return f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES"
+
+    def add(self, df):
+        """追加一批行 (DataFrame 或 dict 列表), 必要时触发 flush"""
+        if df is None:
+            return
+        if not isinstance(df, pd.DataFrame):
+            df = pd.DataFrame(df)
+        if df.empty:
+            return
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"writer for {self.table} is closed")
+            self._frames.append(df[self.columns])
+            self._buffered_rows += len(df)
+            if self._buffered_rows >= self.max_rows or time.monotonic() - self._last_flush >= self.max_seconds:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._frames:
+                self._last_flush = time.monotonic()
+                return 0
+            block = pd.concat(self._frames, ignore_index=True) if len(self._frames) > 1 else self._frames[0]
+            # 单次 add 进来的超大 DataFrame 也按 max_rows 切块, 防止单个 insert 超时
+            written = 0
+            try:
+                for start in range(0, len(block), self.max_rows):
+                    chunk = block.iloc[start:start + self.max_rows]
+                    self.client.insert_dataframe(self.insert_sql, chunk, settings=self.settings)
+                    written += len(chunk)
+                    self.flush_count += 1
+            finally:
+                # 只丢弃已经写成功的部分, 失败时剩余数据仍保留, 可以再次 flush
+                self._frames = [block.iloc[written:]] if written < len(block) else []
+                self._buffered_rows = len(block) - written
+                self.total_rows += written
+            self._last_flush = time.monotonic()
+            return written
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self.flush()
+            finally:
+                self._closed = True
+                _LIVE_WRITERS.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+@atexit.register
+def _flush_on_exit():
+    for writer in list(_LIVE_WRITERS):
+        try:
+            writer.close()
+        except Exception as e:
+            print(f"[BufferedInserter] 退出时写入 {writer.table} 失败: {e}")
@@ -0,0 +1,83 @@
+from datetime import date
+
+import pandas as pd
+
+from infra.db import execute, query_dataframe
+
+# 概念板块成分股的时点 (point-in-time) 存储:
+# 每行是一段成员区间 [valid_from, valid_to), 仍是成员的区间 valid_to = OPEN_END.
+# 关闭区间不做 UPDATE, 而是以更新的 updated_at 重新插入同一行, 由 ReplacingMergeTree 合并.
+MEMBERS_TABLE = 'stock_concept_members'
+MEMBERS_COLUMNS = ['concept_name', 'ts_code', 'valid_from', 'valid_to', 'updated_at']
+OPEN_END = date(2149, 6, 6)  # ClickHouse Date 类型的最大值
+
+
+def ensure_members_table():
+    execute(f"""
+    CREATE TABLE IF NOT EXISTS {MEMBERS_TABLE}
+    (
+        `concept_name` LowCardinality(String),
+        `ts_code` String,
+        `valid_from` Date,
+        `valid_to` Date,
+        `updated_at` DateTime
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    ORDER BY (concept_name, ts_code, valid_from)
+    """)
+
+
+def load_intervals(open_only=False, since=None):
+    """
+    读取 (合并后的) 成员区间; open_only=True 时只返回当前仍有效的区间,
+    since 不为空时只返回在 since 之后仍有效的区间 (valid_to > since).
+    """
+    if open_only:
+        where = f"WHERE valid_to = '{OPEN_END}'"
+    elif since is not None:
+        where = f"WHERE valid_to > '{pd.Timestamp(since).date()}'"
+    else:
+        where = ""
+    df = query_dataframe(f"""
+    SELECT concept_name, ts_code, valid_from, valid_to
+    FROM {MEMBERS_TABLE} FINAL
+    {where}
+    """)
+    if df.empty:
+        return pd.DataFrame(columns=['concept_name', 'ts_code', 'valid_from', 'valid_to'])
+    df['valid_from'] = pd.to_datetime(df['valid_from'])
+    df['valid_to'] = pd.to_datetime(df['valid_to'])
+    return df
+
+
+def diff_snapshot(open_df, snapshot, as_of, updated_at):
+    """
+    对比当前仍有效的区间 open_df 与最新快照 snapshot ({板块名: 成分股集合}), 返回需要写入的行.
+    新出现的成员开一个 [as_of, OPEN_END) 区间; 消失的成员把原区间的 valid_to 改成 as_of.
+    snapshot 中没有的板块 (本次抓取失败) 保持不动.
+    """
+    rows = []
+    current = {}
+    for name, code, valid_from in zip(open_df['concept_name'], open_df['ts_code'], open_df['valid_from']):
+        current.setdefault(name, {})[code] = pd.Timestamp(valid_from).date()
+
+    for name, codes in snapshot.items():
+        existing = current.get(name, {})
+        for code in codes - existing.keys():
+            rows.append((name, code, as_of, OPEN_END, updated_at))
+        for code in existing.keys() - codes:
+            rows.append((name, code, existing[code], as_of, updated_at))
+    return pd.DataFrame(rows, columns=MEMBERS_COLUMNS)
+
+
+def point_in_time_intervals(intervals, lookahead=False):
+    """
+    lookahead=True 时把每个板块首次快照的区间起点前移到最早, 即早于首次快照的日期沿用首次快照的成员
+    (有未来信息, 仅用于没有历史快照的回测).
+    """
+    if not lookahead or intervals.empty:
+        return intervals
+    intervals = intervals.copy()
+    first = intervals.groupby('concept_name')['valid_from'].transform('min')
+    intervals.loc[intervals['valid_from'] == first, 'valid_from'] = pd.Timestamp('1900-01-01')
+    return intervals
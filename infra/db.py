@@ -0,0 +1,118 @@
+import functools
+import importlib
+import os
+import threading
+
+# 连接配置统一从环境变量读取, 各模块不再硬编码 host
+CH_HOST = os.getenv("CH_HOST", "localhost")
+CH_PORT = int(os.getenv("CH_PORT", "9000"))
+CH_USER = os.getenv("CH_USER", "default")
+CH_PASSWORD = os.getenv("CH_PASSWORD", "")
+CH_DATABASE = os.getenv("CH_DATABASE", "stock_data")
+# 原生协议的块压缩 (lz4 / lz4hc / zstd), 设为 0 关闭; 需要安装 clickhouse-cityhash 与对应的 lz4 / zstd,
+# 缺少依赖时退回不压缩
+CH_COMPRESSION = os.getenv("CH_COMPRESSION", "lz4")
+_COMPRESSION_MODULES = {'lz4': 'lz4', 'lz4hc': 'lz4', 'zstd': 'zstd'}
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "stock_data")
+MONGO_POOL_SIZE = int(os.getenv("MONGO_POOL_SIZE", "20"))
+
+# 一个大块可能横跨很多月份分区, 默认上限 100 不够用
+DEFAULT_INSERT_SETTINGS = {'max_partitions_per_insert_block': 2000}
+
+# clickhouse_driver 的 Client 不是线程安全的: 每个线程懒加载并复用自己的连接
+_local = threading.local()
+_mongo = {'client': None}
+_mongo_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _compression():
+    method = CH_COMPRESSION.lower()
+    if method in ("", "0", "false", "none"):
+        return False
+    for module in ('clickhouse_cityhash', _COMPRESSION_MODULES.get(method)):
+        if module is None:
+            continue
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            print(f"[db] CH_COMPRESSION={CH_COMPRESSION} 需要 {module}, 未安装, 改为不压缩传输")
+            return False
+    return method
+
+
+def get_ch_client():
+    """当前线程的 ClickHouse 连接, 第一次使用时才建立 (import 本模块不会连库)"""
+    client = getattr(_local, 'client', None)
+    if client is None:
+        from clickhouse_driver import Client
+        client = Client(
+            host=CH_HOST,
+            port=CH_PORT,
+            user=CH_USER,
+            password=CH_PASSWORD,
+            database=CH_DATABASE,
+            compression=_compression(),
+            settings={'use_numpy': True},
+        )
+        _local.client = client
+    return client
+
+
+def execute(sql, params=None, settings=None):
+    return get_ch_client().execute(sql, params, settings=settings)
+
+
+def query_dataframe(sql, params=None, settings=None):
+    return get_ch_client().query_dataframe(sql, params, settings=settings)
+
+
+def insert_dataframe(table, df, columns=None, chunk_rows=None, settings=None):
+    """
+    按 columns 顺序写入 DataFrame, 返回写入行数.
+    chunk_rows 不为空时分块 insert, 防止单次请求过大超时; 持续攒批写入请用 infra.ch_writer.BufferedInserter.
+    """
+    if df is None or df.empty:
+        return 0
+    columns = list(columns) if columns is not None else list(df.columns)
+    merged = dict(DEFAULT_INSERT_SETTINGS)
+    if settings:
+        merged.update(settings)
+
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES"
+    df = df[columns]
+    step = chunk_rows or len(df)
+    written = 0
+    for start in range(0, len(df), step):
+        chunk = df.iloc[start:start + step]
+        get_ch_client().insert_dataframe(sql, chunk, settings=merged)
+        written += len(chunk)
+    return written
+
+
+def get_mongo_client():
+    """进程内共享的 MongoClient (自带连接池, 线程安全), 第一次使用时才建立"""
+    if _mongo['client'] is None:
+        with _mongo_lock:
+            if _mongo['client'] is None:
+                import pymongo
+                _mongo['client'] = pymongo.MongoClient(MONGO_URI, maxPoolSize=MONGO_POOL_SIZE)
+    return _mongo['client']
+
+
+def get_collection(name, db=None):
+    return get_mongo_client()[db or MONGO_DB][name]
+
+
+def close_connections():
+    """关闭当前线程的 ClickHouse 连接和共享的 MongoClient"""
+    client = getattr(_local, 'client', None)
+    if client is not None:
+        client.disconnect()
+        _local.client = None
+    with _mongo_lock:
+        if _mongo['client'] is not None:
+            _mongo['client'].close()
+            _mongo['client'] = None
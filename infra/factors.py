@@ -0,0 +1,100 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.db import execute
+from infra.schema import TABLES
+
+# 每个 (ts_code, trade_date) 一行: 当日新闻情绪均值 + 两个策略的 alpha_score, 导出时只需一次按主键 join.
+# 不用物化视图: 源表是 ReplacingMergeTree, 同一条新闻/信号重写一次, 物化视图的 avg/sum 就会重复计入.
+# 改为按水位线增量刷新: 源表中 updated_at 晚于上次刷新的行所在的交易日, 整日从 FINAL 重新聚合后覆盖写入.
+FACTOR_TABLE = 'stock_daily_factors'
+# 因子列 -> stock_daily_alpha 中的 strategy_name
+FACTOR_STRATEGIES = {
+    'sector_score': 'sector_rotation_v1',
+    'total_score': 'multi_factor_v1',
+}
+
+
+def ensure_factor_table():
+    execute(f"CREATE TABLE IF NOT EXISTS {FACTOR_TABLE} {TABLES[FACTOR_TABLE]}")
+
+
+def factor_watermark():
+    """上次刷新开始时的服务器时间 (即因子表中最大的 updated_at), 表为空时返回 None"""
+    latest, count = execute(f"SELECT toString(max(updated_at)), count() FROM {FACTOR_TABLE}")[0]
+    return latest if count else None
+
+
+def changed_dates(since):
+    """since 之后有写入的交易日 (新闻情绪, 或导出用到的策略信号)"""
+    rows = execute("""
+    SELECT DISTINCT trade_date FROM (
+        SELECT trade_date FROM stock_news_sentiment WHERE updated_at > toDateTime64(%(since)s, 3)
+        UNION ALL
+        SELECT trade_date FROM stock_daily_alpha
+        WHERE updated_at > toDateTime64(%(since)s, 3) AND strategy_name IN %(strategies)s
+    )
+    ORDER BY trade_date
+    """, {'since': since, 'strategies': tuple(FACTOR_STRATEGIES.values())})
+    return [r[0] for r in rows]
+
+
+def refresh_factors(full=False):
+    """
+    增量刷新因子表, 返回刷新的交易日数 (全量时返回 None).
+    full=True 或因子表为空时从全部历史重建; 重复执行是幂等的.
+    """
+    ensure_factor_table()
+    # 版本号取读源表之前的服务器时间: 刷新过程中新写入的源数据, 下次刷新一定会被重新计算
+    version = execute("SELECT toString(now64(3))")[0][0]
+    since = None if full else factor_watermark()
+
+    params = {'version': version, 'strategies': tuple(FACTOR_STRATEGIES.values())}
+    if since is None:
+        date_filter = ""
+        n_dates = None
+    else:
+        dates = changed_dates(since)
+        if not dates:
+            print(f"{FACTOR_TABLE}: 源数据自 {since} 以来没有变化")
+            return 0
+        date_filter = "AND trade_date IN %(dates)s"
+        params['dates'] = tuple(dates)
+        n_dates = len(dates)
+
+    strategy_columns = ",\n            ".join(
+        f"if(strategy_name = '{strategy}', alpha_score, toFloat64(0)) AS {column}"
+        for column, strategy in FACTOR_STRATEGIES.items()
+    )
+    zero_columns = ", ".join(f"toFloat64(0) AS {column}" for column in FACTOR_STRATEGIES)
+    sum_columns = ", ".join(f"sum({column})" for column in FACTOR_STRATEGIES)
+    execute(f"""
+    INSERT INTO {FACTOR_TABLE} (ts_code, trade_date, sentiment, {', '.join(FACTOR_STRATEGIES)}, updated_at)
+    SELECT ts_code, trade_date, sum(sentiment), {sum_columns}, toDateTime64(%(version)s, 3)
+    FROM (
+        SELECT ts_code, trade_date, avg(score) AS sentiment, {zero_columns}
+        FROM stock_news_sentiment FINAL
+        WHERE 1 {date_filter}
+        GROUP BY ts_code, trade_date
+
+        UNION ALL
+
+        SELECT ts_code, trade_date, toFloat64(0) AS sentiment,
+            {strategy_columns}
+        FROM stock_daily_alpha FINAL
+        WHERE strategy_name IN %(strategies)s {date_filter}
+    )
+    GROUP BY ts_code, trade_date
+    """, params, settings={'max_partitions_per_insert_block': 2000})
+
+    if n_dates is None:
+        print(f"{FACTOR_TABLE}: 已从全部历史重建")
+    else:
+        print(f"{FACTOR_TABLE}: 刷新了 {n_dates} 个交易日 ({params['dates'][0]} ~ {params['dates'][-1]})")
+    return n_dates
+
+
+if __name__ == "__main__":
+    # 全量重建: python infra/factors.py --rebuild
+    refresh_factors(full="--rebuild" in sys.argv[1:])
@@ -0,0 +1,203 @@
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from infra.db import execute, query_dataframe
+
+# 长表 (股票/板块 x 交易日) 的紧凑内存表示, 供 backfill 与 export_to_qlib 共用:
+# 代码/名称列用 category, 日期用 int32 的交易日序号 (calendar 下标), 数值列统一 float32.
+# 按日期分段查询, 每段读回后立即压缩, 峰值内存只有一段的 object 字符串, 而不是全量.
+PANEL_CHUNK_DAYS = int(os.getenv("PANEL_CHUNK_DAYS", "366"))
+# 按代码流式读取时每次查询的代码数
+STREAM_BATCH_SYMBOLS = int(os.getenv("PANEL_STREAM_SYMBOLS", "200"))
+VALUE_DTYPE = np.float32
+
+
+class Panel:
+    """
+    frame: 每行一个 (symbol, day) 观测, 列为 symbol (category), day (int32), labels (category), values (float32);
+    行按 day 升序. calendar[day] 还原交易日.
+    """
+
+    def __init__(self, frame, calendar, symbol='symbol', values=(), labels=()):
+        self.frame = frame
+        self.calendar = calendar
+        self.symbol = symbol
+        self.values = list(values)
+        self.labels = list(labels)
+
+    @property
+    def empty(self):
+        return self.frame.empty
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def symbols(self):
+        return self.frame[self.symbol].cat.categories
+
+    def dates(self):
+        """每行对应的交易日 (DatetimeIndex)"""
+        return self.calendar[self.frame['day'].to_numpy()]
+
+    def matrix(self, value):
+        """日期 x 代码 的宽表, 与 DataFrame.pivot 的结果一致 (行列均升序), 缺失为 NaN"""
+        codes = self.frame[self.symbol].cat.codes.to_numpy()
+        mat = np.full((len(self.calendar), len(self.symbols)), np.nan, dtype=VALUE_DTYPE)
+        mat[self.frame['day'].to_numpy(), codes] = self.frame[value].to_numpy()
+        return pd.DataFrame(mat, index=self.calendar.rename(None), columns=self.symbols.rename(None), copy=False)
+
+    def label_map(self, label):
+        """代码 -> 标签 (如 concept_code -> concept_name), 同一代码有多个标签时取第一次出现的"""
+        pairs = self.frame[[self.symbol, label]].drop_duplicates(subset=[self.symbol])
+        return dict(zip(pairs[self.symbol].astype(str), pairs[label].astype(str)))
+
+    def memory_mb(self):
+        return self.frame.memory_usage(deep=True).sum() / 1e6
+
+
+def _as_exprs(columns):
+    """['close', ...] 或 {'close': 't1.close', ...} -> {别名: 表达式}"""
+    if isinstance(columns, dict):
+        return dict(columns)
+    return {c: c for c in columns}
+
+
+def _date_chunks(start, end, chunk_days):
+    lo = pd.Timestamp(start).date()
+    end = pd.Timestamp(end).date()
+    while lo < end:
+        hi = min(lo + timedelta(days=chunk_days), end)
+        yield lo, hi
+        lo = hi
+
+
+class _Encoder:
+    """跨分段累积的字符串 -> int32 编码, 最终转换成 category"""
+
+    def __init__(self):
+        self.index = {}
+        self.uniques = []
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(values)
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, u in enumerate(uniques):
+            code = self.index.get(u)
+            if code is None:
+                code = self.index[u] = len(self.uniques)
+                self.uniques.append(u)
+            mapping[i] = code
+        # 缺失值 (factorize 编码为 -1) 保持 -1
+        out = np.full(len(codes), -1, dtype=np.int32)
+        ok = codes >= 0
+        out[ok] = mapping[codes[ok]]
+        return out
+
+    def categorical(self, codes):
+        cat = pd.Categorical.from_codes(codes, categories=pd.Index(self.uniques, dtype=object))
+        return cat.reorder_categories(sorted(self.uniques))
+
+
+def load_panel(source, values, symbol='ts_code', date_col='trade_date', labels=(), where=None,
+               start=None, end=None, params=None, chunk_days=PANEL_CHUNK_DAYS, dedupe=True):
+    """
+    读取 source (表名, 或 FROM 之后带 JOIN 的 SQL 片段) 的长表, 只查询 values/labels 中列出的列 (列裁剪).
+    values/labels 可以是列名列表, 也可以是 {别名: 表达式}; symbol/date_col 是表达式, 结果列名固定为 symbol/day.
+    查询按 [start, end) 以 chunk_days 分段, 每段的日期范围以 %(start)s / %(end)s 传入,
+    source 中的子查询也可以引用这两个参数来缩小自己的扫描范围.
+    start 为空时取 source 中的最小日期 (此时 source 不能引用 start/end 参数); end 为空时取明天.
+    dedupe=True 时同一 (symbol, day) 只保留第一行.
+    """
+    values, labels = _as_exprs(values), _as_exprs(labels)
+    if start is None:
+        start = execute(f"SELECT min({date_col}) FROM {source}" + (f" WHERE {where}" if where else ""), params)[0][0]
+        if start is None:
+            start = date.today()
+    if end is None:
+        end = date.today() + timedelta(days=1)
+
+    select = [f"{symbol} AS symbol", f"{date_col} AS day"]
+    select += [f"{expr} AS {alias}" for alias, expr in {**labels, **values}.items()]
+    conditions = [f"{date_col} >= %(start)s", f"{date_col} < %(end)s"]
+    if where:
+        conditions.append(f"({where})")
+    sql = f"SELECT {', '.join(select)} FROM {source} WHERE {' AND '.join(conditions)}"
+
+    sym_encoder = _Encoder()
+    label_encoders = {name: _Encoder() for name in labels}
+    calendar = []
+    parts = []
+    for lo, hi in _date_chunks(start, end, chunk_days):
+        chunk = query_dataframe(sql, {**(params or {}), 'start': lo, 'end': hi})
+        if chunk.empty:
+            continue
+        days = pd.to_datetime(chunk['day']).to_numpy(dtype='datetime64[ns]')
+        chunk_dates = np.unique(days)
+        part = {
+            'symbol': sym_encoder.encode(chunk['symbol'].to_numpy()),
+            'day': (np.searchsorted(chunk_dates, days) + len(calendar)).astype(np.int32),
+        }
+        for name, enc in label_encoders.items():
+            part[name] = enc.encode(chunk[name].to_numpy())
+        for name in values:
+            part[name] = pd.to_numeric(chunk[name], errors='coerce').to_numpy(dtype=VALUE_DTYPE)
+        del chunk
+        part = pd.DataFrame(part)
+        if dedupe:
+            part = part.drop_duplicates(subset=['day', 'symbol'])
+        # 分段按日期不重叠且递增, 段内排序后整体即按 day 升序
+        parts.append(part.sort_values('day', kind='stable'))
+        calendar.extend(chunk_dates)
+
+    columns = ['symbol', 'day', *labels, *values]
+    if not parts:
+        frame = pd.DataFrame({c: pd.Series(dtype=VALUE_DTYPE if c in values else object) for c in columns})
+        frame['symbol'] = frame['symbol'].astype('category')
+        frame['day'] = frame['day'].astype(np.int32)
+        for name in labels:
+            frame[name] = frame[name].astype('category')
+        return Panel(frame, pd.DatetimeIndex([], name='trade_date'), values=values, labels=labels)
+
+    frame = pd.concat(parts, ignore_index=True)
+    del parts
+    frame['symbol'] = sym_encoder.categorical(frame['symbol'].to_numpy())
+    for name, enc in label_encoders.items():
+        frame[name] = enc.categorical(frame[name].to_numpy())
+    return Panel(frame[columns], pd.DatetimeIndex(calendar, name='trade_date'), values=values, labels=labels)
+
+
+def iter_symbols(source, values, symbols, calendar, symbol='ts_code', date_col='trade_date', params=None,
+                 batch_size=STREAM_BATCH_SYMBOLS):
+    """
+    按 (symbol, 日期) 顺序流式读取, 逐只产出 (代码, 日历下标 int32 数组, {列: float32 数组}).
+    symbols 为已排序的代码列表, 每次查询其中连续 batch_size 只 (代码范围 [%(lo)s, %(hi)s], source 中的子查询也可以引用),
+    ORDER BY 与 stock_daily 的主键一致; 内存里同时只有一段的数据, 与全量数据多大无关.
+    calendar 必须包含结果中出现的所有日期; 同一 (symbol, 日期) 只保留第一行.
+    """
+    values = _as_exprs(values)
+    select = [f"{symbol} AS symbol", f"{date_col} AS day"]
+    select += [f"{expr} AS {alias}" for alias, expr in values.items()]
+    sql = (f"SELECT {', '.join(select)} FROM {source} "
+           f"WHERE {symbol} >= %(lo)s AND {symbol} <= %(hi)s "
+           f"ORDER BY {symbol}, {date_col}")
+    cal = calendar.to_numpy(dtype='datetime64[ns]')
+
+    for i in range(0, len(symbols), batch_size):
+        batch = symbols[i:i + batch_size]
+        chunk = query_dataframe(sql, {**(params or {}), 'lo': batch[0], 'hi': batch[-1]})
+        if chunk.empty:
+            continue
+        codes = chunk['symbol'].to_numpy()
+        days = np.searchsorted(cal, pd.to_datetime(chunk['day']).to_numpy(dtype='datetime64[ns]')).astype(np.int32)
+        columns = {name: pd.to_numeric(chunk[name], errors='coerce').to_numpy(dtype=VALUE_DTYPE) for name in values}
+        del chunk
+        # 结果已按代码排序, 相邻代码不同的位置即为每只股票的分界
+        bounds = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(codes)]])):
+            sym_days = days[lo:hi]
+            keep = np.concatenate([[True], sym_days[1:] != sym_days[:-1]])
+            yield codes[lo], sym_days[keep], {name: col[lo:hi][keep] for name, col in columns.items()}
@@ -0,0 +1,225 @@
+"""
+每日流水线: 按依赖关系 (DAG) 调度各个脚本, 互不依赖的阶段并发执行.
+
+    python infra/pipeline.py                 # 跑完整流水线
+    python infra/pipeline.py --force         # 忽略输入指纹, 所有阶段都重跑
+    python infra/pipeline.py --only export_to_qlib predict_tomorrow
+    python infra/pipeline.py --dry-run       # 只打印执行计划
+
+有 inputs 的阶段会先计算输入指纹 (表的行数/最新日期, 文件内容 hash, 脚本本身的 hash),
+和上次成功运行时一致就跳过. 每次运行的各阶段耗时追加到 .cache/pipeline_runs.jsonl.
+"""
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+CACHE_DIR = ROOT / ".cache"
+STATE_FILE = CACHE_DIR / "pipeline_state.json"
+RUNS_FILE = CACHE_DIR / "pipeline_runs.jsonl"
+LOG_DIR = CACHE_DIR / "pipeline_logs"
+
+
+class Stage:
+    """
+    一个流水线阶段 = 一个脚本.
+    deps: 必须先成功的阶段; inputs: 决定是否需要重跑的输入,
+    'table:<name>[:<日期列>]' 表示 ClickHouse 表 (行数 + 日期列最大值, 默认 trade_date), 'mongo:<collection>' 表示 MongoDB 集合, 'file:<path>' 表示文件.
+    inputs 为空的阶段 (抓取外部数据 / 下单) 每次都执行.
+    """
+
+    def __init__(self, name, script, deps=(), inputs=(), args=()):
+        self.name = name
+        self.script = script
+        self.args = list(args)
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+
+
+STAGES = [
+    Stage('fetch_akshare', 'data_ingestion/fetch_akshare.py'),
+    Stage('fetch_benchmark', 'data_ingestion/fetch_benchmark.py'),
+    Stage('fetch_concepts', 'data_ingestion/fetch_concepts.py'),
+    Stage('fetch_news', 'data_ingestion/fetch_news.py'),
+    Stage('fetch_concept_members', 'data_ingestion/fetch_concept_members.py'),
+    Stage('strategy_llm', 'research/strategy_llm.py',
+          deps=['fetch_news'], inputs=['mongo:news_cailianshe']),
+    Stage('backfill_sector_rotation', 'research/backfill_sector_rotation.py',
+          deps=['fetch_concepts', 'fetch_concept_members'], args=['--incremental'],
+          inputs=['table:stock_concept_daily', 'table:stock_concept_members:updated_at']),
+    Stage('export_to_qlib', 'data_processing/export_to_qlib.py',
+          deps=['fetch_akshare', 'fetch_benchmark', 'strategy_llm', 'backfill_sector_rotation'],
+          inputs=['table:stock_daily:updated_at', 'table:stock_news_sentiment:updated_at',
+                  'table:stock_daily_alpha:updated_at']),
+    Stage('predict_tomorrow', 'trade/predict_tomorrow.py',
+          deps=['export_to_qlib'], inputs=['file:qlib_data/cn_data/export_state.json']),
+    Stage('auto_trader', 'trade/auto_trader.py', deps=['predict_tomorrow']),
+]
+
+
+def _hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def input_state(spec):
+    """单个输入的当前状态, 读取失败时返回 None (视为已变化)"""
+    kind, _, target = spec.partition(':')
+    try:
+        if kind == 'table':
+            from infra.db import execute
+            table, _, column = target.partition(':')
+            count, latest = execute(f"SELECT count(), max({column or 'trade_date'}) FROM {table}")[0]
+            return [int(count), str(latest)]
+        if kind == 'mongo':
+            from infra.db import get_collection
+            coll = get_collection(target)
+            latest = coll.find_one(sort=[("crawled_at", -1)], projection={'crawled_at': 1})
+            return [coll.estimated_document_count(), str(latest.get('crawled_at')) if latest else None]
+        if kind == 'file':
+            path = ROOT / target
+            return _hash_file(path) if path.exists() else None
+    except Exception as e:
+        print(f"[pipeline] 读取输入 {spec} 失败, 按已变化处理: {e}")
+        return None
+    raise ValueError(f"unknown input spec: {spec}")
+
+
+def fingerprint(stage):
+    if not stage.inputs:
+        return None
+    states = {spec: input_state(spec) for spec in stage.inputs}
+    if any(v is None for v in states.values()):
+        return None
+    states['script'] = _hash_file(ROOT / stage.script)
+    return hashlib.sha1(json.dumps(states, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_state():
+    try:
+        return json.loads(STATE_FILE.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(state):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_suffix('.tmp')
+    tmp.write_text(json.dumps(state, indent=2, ensure_ascii=False), encoding='utf-8')
+    tmp.replace(STATE_FILE)
+
+
+def run_script(stage):
+    """子进程执行脚本 (工作目录为仓库根目录), 输出写入 .cache/pipeline_logs/<stage>.log"""
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log_path = LOG_DIR / f"{stage.name}.log"
+    started = time.monotonic()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        proc = subprocess.run([sys.executable, str(ROOT / stage.script), *stage.args], cwd=ROOT,
+                              stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode, time.monotonic() - started
+
+
+def select_stages(only=None):
+    by_name = {s.name: s for s in STAGES}
+    if not only:
+        return STAGES
+    unknown = [n for n in only if n not in by_name]
+    if unknown:
+        raise SystemExit(f"unknown stage(s): {', '.join(unknown)}")
+    return [s for s in STAGES if s.name in only]
+
+
+def run_pipeline(only=None, force=False, max_workers=4, dry_run=False):
+    """
+    调度执行, 返回 {阶段名: {'status': ..., 'seconds': ...}}.
+    status: ok / failed / skipped (输入未变化) / blocked (上游失败).
+    --only 选中的阶段之间仍按依赖顺序执行, 未选中的上游视为已完成.
+    """
+    stages = select_stages(only)
+    selected = {s.name for s in stages}
+    state = load_state()
+    results = {}
+    pending = {s.name: s for s in stages}
+    running = {}
+    run_started = time.monotonic()
+
+    def ready(stage):
+        return all(d not in selected or d in results for d in stage.deps)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if not ready(stage):
+                    continue
+                del pending[name]
+                if any(results.get(d, {}).get('status') in ('failed', 'blocked') for d in stage.deps):
+                    results[name] = {'status': 'blocked', 'seconds': 0.0}
+                    print(f"[pipeline] {name}: 上游失败, 跳过")
+                    continue
+
+                fp = None if force else fingerprint(stage)
+                if fp is not None and state.get(name) == fp:
+                    results[name] = {'status': 'skipped', 'seconds': 0.0}
+                    print(f"[pipeline] {name}: 输入未变化, 跳过")
+                    continue
+                if dry_run:
+                    results[name] = {'status': 'planned', 'seconds': 0.0}
+                    print(f"[pipeline] {name}: 将执行 {stage.script}")
+                    continue
+
+                print(f"[pipeline] {name}: 开始")
+                running[executor.submit(run_script, stage)] = stage
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    code, seconds = future.result()
+                except Exception as e:
+                    print(f"[pipeline] {stage.name}: 启动失败 {e}")
+                    code, seconds = -1, 0.0
+                status = 'ok' if code == 0 else 'failed'
+                results[stage.name] = {'status': status, 'seconds': round(seconds, 2)}
+                print(f"[pipeline] {stage.name}: {status} ({seconds:.1f}s)")
+                if status == 'ok':
+                    # 指纹取运行之后的输入状态: 本阶段自己写入的表 (如果也是输入) 不会导致下次误判为变化
+                    fp = fingerprint(stage)
+                    if fp is not None:
+                        state[stage.name] = fp
+                        save_state(state)
+
+    wall = time.monotonic() - run_started
+    if not dry_run:
+        total = sum(r['seconds'] for r in results.values())
+        print(f"[pipeline] 完成: 总耗时 {wall:.1f}s (各阶段耗时之和 {total:.1f}s)")
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(RUNS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'started_at': datetime.now().isoformat(timespec='seconds'),
+                                'wall_seconds': round(wall, 2), 'stages': results}, ensure_ascii=False) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the nightly data/research/trading pipeline")
+    parser.add_argument('--only', nargs='+', help="only run these stages")
+    parser.add_argument('--force', action='store_true', help="ignore input fingerprints and rerun everything")
+    parser.add_argument('--workers', type=int, default=4, help="max concurrent stages")
+    parser.add_argument('--dry-run', action='store_true', help="print the plan without running anything")
+    args = parser.parse_args()
+
+    results = run_pipeline(only=args.only, force=args.force, max_workers=args.workers, dry_run=args.dry_run)
+    sys.exit(1 if any(r['status'] in ('failed', 'blocked') for r in results.values()) else 0)
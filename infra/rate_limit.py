@@ -0,0 +1,52 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限速器.
+    rate: 每秒补充的令牌数 (即长期平均请求速率), burst: 桶容量 (允许的瞬时突发请求数)
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1.0):
+        """阻塞直到拿到令牌"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_call(func, *args, retries=3, backoff=1.0, max_backoff=30.0, limiter=None, **kwargs):
+    """
+    带限速和指数退避的调用: 每次尝试前先向 limiter 取令牌,
+    失败后等待 backoff * 2^n (加随机抖动) 再重试, 重试耗尽则抛出最后一次的异常.
+    """
+    for attempt in range(retries):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            delay = min(max_backoff, backoff * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.5))
@@ -0,0 +1,124 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.db import execute
+
+# 会被重复写入的三张表都用 ReplacingMergeTree(updated_at):
+# 同一主键重复 insert 时保留 updated_at 最新的一行, 重跑只需要再 insert 一次, 不再需要 ALTER ... DELETE.
+# updated_at 有默认值, 现有写入路径不用带这一列; 读取端用 FINAL (或 argMax) 去重.
+VERSION_COLUMN = "`updated_at` DateTime64(3) DEFAULT now64(3)"
+
+TABLES = {
+    'stock_daily': f"""
+    (
+        `ts_code` String,
+        `trade_date` Date,
+        `open` Float64,
+        `high` Float64,
+        `low` Float64,
+        `close` Float64,
+        `pre_close` Float64,
+        `change` Float64,
+        `pct_chg` Float64,
+        `vol` Float64,
+        `amount` Float64,
+        `turnover_rate` Float64,
+        {VERSION_COLUMN}
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    PARTITION BY toYYYYMM(trade_date)
+    ORDER BY (ts_code, trade_date)
+    """,
+    'stock_daily_alpha': f"""
+    (
+        `ts_code` String,
+        `trade_date` Date,
+        `strategy_name` LowCardinality(String),
+        `alpha_score` Float64,
+        {VERSION_COLUMN}
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    PARTITION BY toYYYYMM(trade_date)
+    ORDER BY (strategy_name, ts_code, trade_date)
+    """,
+    'stock_news_sentiment': f"""
+    (
+        `ts_code` String,
+        `trade_date` Date,
+        `publish_time` DateTime,
+        `news_title` String,
+        `score` Float64,
+        `magnitude` Float64,
+        `certainty` Float64,
+        `reason` String,
+        {VERSION_COLUMN}
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    PARTITION BY toYYYYMM(trade_date)
+    ORDER BY (ts_code, trade_date, publish_time, news_title)
+    """,
+    # 导出用的预聚合因子表, 由 infra/factors.py 增量刷新; updated_at 由刷新过程显式写入 (作为下次刷新的水位线)
+    'stock_daily_factors': f"""
+    (
+        `ts_code` String,
+        `trade_date` Date,
+        `sentiment` Float64,
+        `sector_score` Float64,
+        `total_score` Float64,
+        {VERSION_COLUMN}
+    )
+    ENGINE = ReplacingMergeTree(updated_at)
+    PARTITION BY toYYYYMM(trade_date)
+    ORDER BY (ts_code, trade_date)
+    """,
+}
+
+
+def ensure_tables():
+    for name, body in TABLES.items():
+        execute(f"CREATE TABLE IF NOT EXISTS {name} {body}")
+
+
+def table_engine(name):
+    rows = execute(
+        "SELECT engine FROM system.tables WHERE database = currentDatabase() AND name = %(name)s",
+        {'name': name},
+    )
+    return rows[0][0] if rows else None
+
+
+def migrate_table(name):
+    """
+    把旧的 MergeTree 表迁移为带版本的 ReplacingMergeTree: 建新表 -> INSERT SELECT -> EXCHANGE TABLES.
+    旧数据保留在 <name>_pre_replacing, 确认无误后手动 DROP.
+    """
+    engine = table_engine(name)
+    if engine is None:
+        execute(f"CREATE TABLE {name} {TABLES[name]}")
+        print(f"{name}: created")
+        return
+    if engine == 'ReplacingMergeTree':
+        print(f"{name}: already ReplacingMergeTree, skip")
+        return
+
+    tmp = f"{name}_replacing"
+    execute(f"DROP TABLE IF EXISTS {tmp}")
+    execute(f"CREATE TABLE {tmp} {TABLES[name]}")
+    columns = [c for c, _ in execute(f"SELECT name, type FROM system.columns WHERE database = currentDatabase() AND table = %(t)s",
+                                     {'t': name}) if c != 'updated_at']
+    cols = ", ".join(f"`{c}`" for c in columns)
+    execute(f"INSERT INTO {tmp} ({cols}) SELECT {cols} FROM {name}",
+            settings={'max_partitions_per_insert_block': 2000})
+    execute(f"EXCHANGE TABLES {name} AND {tmp}")
+    execute(f"RENAME TABLE {tmp} TO {name}_pre_replacing")
+    print(f"{name}: migrated {engine} -> ReplacingMergeTree (old data kept in {name}_pre_replacing)")
+
+
+if __name__ == "__main__":
+    # 一次性迁移: python infra/schema.py --migrate
+    if "--migrate" in sys.argv[1:]:
+        for table in TABLES:
+            migrate_table(table)
+    else:
+        ensure_tables()
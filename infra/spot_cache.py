@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from infra.ak_replay import ak
+
+# 全市场快照缓存: 进程内 memo + 磁盘 parquet, 超过 TTL 才重新请求东财
+SPOT_CACHE_TTL = float(os.getenv("SPOT_CACHE_TTL", "60"))
+SPOT_CACHE_FILE = Path(os.getenv(
+    "SPOT_CACHE_FILE",
+    Path(__file__).resolve().parent.parent / ".cache" / "stock_zh_a_spot_em.parquet",
+))
+
+# stock_zh_a_spot_em 的中文列 -> 统一英文列 (各模块原来各自做一遍)
+SPOT_COLUMNS = {
+    '代码': 'ts_code',
+    '名称': 'name',
+    '最新价': 'price',
+    '今开': 'open',
+    '最高': 'high',
+    '最低': 'low',
+    '昨收': 'pre_close',
+    '涨跌额': 'change',
+    '涨跌幅': 'pct_chg',
+    '成交量': 'vol',
+    '成交额': 'amount',
+    '换手率': 'turnover_rate',
+    '振幅': 'amplitude',
+    '量比': 'volume_ratio',
+    '总市值': 'total_mv',
+    '流通市值': 'circ_mv',
+}
+SPOT_NUMERIC_COLUMNS = [c for c in SPOT_COLUMNS.values() if c not in ('ts_code', 'name')]
+
+_memo = {'df': None, 'fetched_at': 0.0}
+_lock = threading.Lock()
+
+
+def normalize_spot(df):
+    """
+    原始快照 -> 统一列名和类型: ts_code 为 6 位字符串, 数值列为 float64 (无法解析的值为 NaN).
+    接口偶尔缺列, 缺的列补 NaN, 保证下游拿到的列集合固定.
+    """
+    df = df.rename(columns=SPOT_COLUMNS)
+    out = pd.DataFrame(index=df.index)
+    out['ts_code'] = df['ts_code'].astype(str).str.zfill(6)
+    out['name'] = df['name'].astype(str) if 'name' in df.columns else ''
+    for col in SPOT_NUMERIC_COLUMNS:
+        if col in df.columns:
+            out[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        else:
+            out[col] = float('nan')
+    return out.drop_duplicates('ts_code', keep='last').reset_index(drop=True)
+
+
+def _read_disk(max_age):
+    try:
+        age = time.time() - SPOT_CACHE_FILE.stat().st_mtime
+    except FileNotFoundError:
+        return None, 0.0
+    if age > max_age:
+        return None, 0.0
+    try:
+        return pd.read_parquet(SPOT_CACHE_FILE), SPOT_CACHE_FILE.stat().st_mtime
+    except Exception as e:
+        print(f"[spot_cache] 读取缓存文件失败, 重新抓取: {e}")
+        return None, 0.0
+
+
+def _write_disk(df):
+    """先写临时文件再 os.replace, 其他进程只会看到完整的旧文件或新文件"""
+    try:
+        SPOT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = SPOT_CACHE_FILE.with_name(f"{SPOT_CACHE_FILE.name}.{os.getpid()}.tmp")
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, SPOT_CACHE_FILE)
+    except Exception as e:
+        print(f"[spot_cache] 写入缓存文件失败 (仅使用进程内缓存): {e}")
+
+
+def get_spot_snapshot(max_age=None, refresh=False):
+    """
+    返回统一列名的全市场快照 DataFrame (副本, 调用方可以随意修改).
+    依次尝试: 进程内 memo -> 磁盘缓存 -> 东财接口; max_age 默认为 SPOT_CACHE_TTL 秒.
+    refresh=True 时跳过缓存直接抓取, 结果同样写回缓存供其他消费者使用.
+    网络失败时抛出异常, 由调用方决定如何降级.
+    """
+    max_age = SPOT_CACHE_TTL if max_age is None else max_age
+    with _lock:
+        if not refresh:
+            if _memo['df'] is not None and time.time() - _memo['fetched_at'] <= max_age:
+                return _memo['df'].copy()
+            df, fetched_at = _read_disk(max_age)
+            if df is not None:
+                _memo.update(df=df, fetched_at=fetched_at)
+                return df.copy()
+
+        raw = ak.stock_zh_a_spot_em()
+        if raw is None or raw.empty:
+            raise ValueError("stock_zh_a_spot_em 返回空数据")
+        df = normalize_spot(raw)
+        _write_disk(df)
+        _memo.update(df=df, fetched_at=time.time())
+        return df.copy()
+
+
+def clear_spot_cache():
+    """清空进程内 memo (磁盘文件靠 TTL 自然过期)"""
+    with _lock:
+        _memo.update(df=None, fetched_at=0.0)
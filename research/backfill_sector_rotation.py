@@ -1,181 +1,259 @@
 import pandas as pd
 import numpy as np
-import akshare as ak
-from clickhouse_driver import Client
 from datetime import datetime, timedelta
-import time
-import random
-from tqdm import tqdm
+from pathlib import Path
+import os
+import sys
 
-# Config
-CH_HOST = '...'
-CH_DB = 'stock_data'
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ch_writer import BufferedInserter
+from infra.db import get_ch_client, query_dataframe
+from infra.factors import refresh_factors
+from infra.concept_members import load_intervals, point_in_time_intervals
+from infra.panel import load_panel
 
+# Config
 START_DATE = '2020-01-01'
 MOMENTUM_WINDOW = 5
 VOL_WINDOW = 20
 TOP_K_CONCEPTS = 5
 ALPHA_SCALE = 1.0
 
-# 全局缓存: 避免重复请求同一个板块的成分股
-# format: {'板块名称': ['000001', '600519', ...]}
-CONCEPT_STOCKS_CACHE = {}
+# 成分股按日期取时点快照; 设为 1 时, 早于首次快照的日期沿用首次快照 (有未来信息, 仅在缺少历史快照时使用)
+MEMBERSHIP_LOOKAHEAD = os.getenv("SECTOR_MEMBERSHIP_LOOKAHEAD", "0") == "1"
 
-def get_client():
-    return Client(host=CH_HOST, database=CH_DB, settings={'use_numpy': True})
+STRATEGY_NAME = 'sector_rotation_v1'
+ALPHA_COLUMNS = ['ts_code', 'trade_date', 'strategy_name', 'alpha_score']
+# 增量模式额外多取的交易日, 防止个别板块停更导致窗口起点的数据不足
+WARMUP_PADDING = 10
 
-def fetch_all_concept_history():
-    print(f"[1/4] Fetching concept history since {START_DATE}...")
-    client = get_client()
-    
+def fetch_all_concept_history(query_start=None):
+    """
+    读取 query_start 之后的板块日线, 返回紧凑的 Panel (concept_code/concept_name 为 category, close/vol 为 float32).
+    """
     # 多取一点数据用于计算初始的 MA
-    query_start = (datetime.strptime(START_DATE, "%Y-%m-%d") - timedelta(days=60)).strftime("%Y-%m-%d")
-    
+    if query_start is None:
+        query_start = (datetime.strptime(START_DATE, "%Y-%m-%d") - timedelta(days=60)).strftime("%Y-%m-%d")
+    print(f"[1/4] Fetching concept history since {query_start}...")
+
+    panel = load_panel('stock_concept_daily', ['close', 'vol'], symbol='concept_code',
+                       labels=['concept_name'], start=query_start)
+
+    print(f"Loaded {len(panel)} rows of concept data ({panel.memory_mb():.1f} MB).")
+
+    return panel
+
+def get_last_signal_date():
+    """sector_rotation_v1 已写入的最新日期, 没有数据时返回 None"""
+    rows = get_ch_client().execute(
+        f"SELECT max(trade_date), count() FROM stock_daily_alpha WHERE strategy_name = '{STRATEGY_NAME}'"
+    )
+    last, count = rows[0]
+    return pd.Timestamp(last) if count else None
+
+def get_warmup_start(last_date):
+    """
+    last_date 之前第 N 个交易日 (N = 滚动窗口长度 + WARMUP_PADDING), 增量模式只需从这一天开始读取.
+    """
+    n = max(MOMENTUM_WINDOW, VOL_WINDOW) + WARMUP_PADDING
+    rows = get_ch_client().execute(f"""
+    SELECT min(trade_date) FROM (
+        SELECT DISTINCT trade_date FROM stock_concept_daily
+        WHERE trade_date <= '{last_date.date()}'
+        ORDER BY trade_date DESC
+        LIMIT {n}
+    )
+    """)
+    return pd.Timestamp(rows[0][0]).strftime("%Y-%m-%d")
+
+def fetch_top_concepts_server_side(query_start, score_start, top_k=TOP_K_CONCEPTS):
+    """
+    用 ClickHouse 窗口函数计算 compute_concept_scores + select_top_concepts, 只返回每天的 Top-K 行
+    (trade_date, concept_code, concept_name, score).
+    百分位排名与 pandas rank(pct=True) 一致 (并列取平均名次); 并列分数按 concept_code 升序取前 K 个.
+    注意: 动量和量比按每个板块自己的交易行滚动, 与 pandas 在全市场日期上 pivot 后滚动相比,
+    只有板块存在停更缺口时结果才会不同.
+    """
+    m, v = MOMENTUM_WINDOW, VOL_WINDOW
     sql = f"""
-    SELECT trade_date, concept_code, concept_name, close, vol 
-    FROM stock_concept_daily 
-    WHERE trade_date >= '{query_start}'
-    ORDER BY trade_date ASC
+    SELECT trade_date, concept_code, concept_name, score
+    FROM (
+        SELECT
+            trade_date, concept_code, concept_name, score,
+            row_number() OVER (PARTITION BY trade_date ORDER BY score DESC, concept_code ASC) AS pos
+        FROM (
+            SELECT
+                trade_date, concept_code, concept_name,
+                0.7 * (rank() OVER (PARTITION BY trade_date ORDER BY momentum)
+                       + (count() OVER (PARTITION BY trade_date, momentum) - 1) / 2)
+                    / count() OVER (PARTITION BY trade_date)
+              + 0.3 * (rank() OVER (PARTITION BY trade_date ORDER BY vol_ratio)
+                       + (count() OVER (PARTITION BY trade_date, vol_ratio) - 1) / 2)
+                    / count() OVER (PARTITION BY trade_date) AS score
+            FROM (
+                SELECT
+                    trade_date, concept_code, concept_name,
+                    close / lagInFrame(close, {m}) OVER w_mom - 1 AS momentum,
+                    count() OVER w_mom AS mom_n,
+                    vol / (avg(vol) OVER w_vol + 1e-9) AS vol_ratio,
+                    count() OVER w_vol AS vol_n
+                FROM (
+                    SELECT trade_date, concept_code, any(concept_name) AS concept_name, any(close) AS close, any(vol) AS vol
+                    FROM stock_concept_daily
+                    WHERE trade_date >= '{query_start}'
+                    GROUP BY trade_date, concept_code
+                )
+                WINDOW
+                    w_mom AS (PARTITION BY concept_code ORDER BY trade_date ROWS BETWEEN {m} PRECEDING AND CURRENT ROW),
+                    w_vol AS (PARTITION BY concept_code ORDER BY trade_date ROWS BETWEEN {v - 1} PRECEDING AND CURRENT ROW)
+            )
+            WHERE mom_n > {m} AND vol_n >= {v} AND trade_date >= '{pd.Timestamp(score_start).date()}'
+        )
+    )
+    WHERE pos <= {top_k}
+    ORDER BY trade_date, pos
     """
-    
-    data = client.execute(sql)
-    df = pd.DataFrame(data, columns=['trade_date', 'concept_code', 'concept_name', 'close', 'vol'])
-    df['trade_date'] = pd.to_datetime(df['trade_date'])
-    df = df.drop_duplicates(subset=['trade_date', 'concept_code'])
-    
-    print(f"Loaded {len(df)} rows of concept data.")
+    top = query_dataframe(sql)
+    if top.empty:
+        return pd.DataFrame(columns=['trade_date', 'concept_code', 'concept_name', 'score'])
+    top['trade_date'] = pd.to_datetime(top['trade_date'])
+    print(f"Received {len(top)} top-concept rows from ClickHouse.")
+    return top
 
-    return df
+def load_membership(since=None):
+    """
+    从 stock_concept_members 加载时点成分股区间 (由 data_ingestion/fetch_concept_members.py 维护), 回测全程不联网.
+    since 不为空时只加载在 since 之后仍有效的区间.
+    """
+    intervals = point_in_time_intervals(load_intervals(since=since), lookahead=MEMBERSHIP_LOOKAHEAD)
+    print(f"Loaded {len(intervals)} membership intervals for {intervals['concept_name'].nunique()} concepts "
+          f"(lookahead={MEMBERSHIP_LOOKAHEAD}).")
+    return intervals
 
-def get_stocks_in_concept_cached(concept_name):
-    """带内存缓存的成分股获取函数"""
-    if concept_name in CONCEPT_STOCKS_CACHE:
-        return CONCEPT_STOCKS_CACHE[concept_name]
-    
-    try:
-        df = ak.stock_board_concept_cons_em(symbol=concept_name)
-        if df is not None and not df.empty:
-            stocks = df['代码'].astype(str).tolist()
-            CONCEPT_STOCKS_CACHE[concept_name] = stocks
-            time.sleep(0.2) # 防封
-            return stocks
-    except Exception as e:
-        print(f"Error fetching {concept_name}: {e}")
-    
-    CONCEPT_STOCKS_CACHE[concept_name] = [] # 即使失败也缓存空列表, 防止死循环重试
-    return []
-
-def main():
-    # 1. 获取所有历史数据
-    df = fetch_all_concept_history()
-    if df.empty: return
-
-    print("[2/4] Calculating historical scores...")
-    # Pivot
-    df_close = df.pivot(index='trade_date', columns='concept_code', values='close')
-    df_vol = df.pivot(index='trade_date', columns='concept_code', values='vol')
-    
-    # Vectorized Calculation (一次性算出所有日期的因子)
-    momentum = df_close.pct_change(MOMENTUM_WINDOW)
-    vol_ma = df_vol.rolling(window=VOL_WINDOW).mean()
+def pivot_concept_history(panel):
+    """Panel -> (收盘价, 成交量) 两个 日期 x 板块 float32 矩阵"""
+    return panel.matrix('close'), panel.matrix('vol')
+
+def score_concepts(df_close, df_vol, momentum_window=MOMENTUM_WINDOW, vol_window=VOL_WINDOW, mom_weight=0.7, vol_weight=0.3):
+    """
+    整个 日期 x 板块 矩阵一次算完: 动量与量比各自做截面百分位排名 (axis=1),
+    只有两个因子都有值的板块参与当天排名, 得分 = mom_weight * 动量排名 + vol_weight * 量比排名.
+    矩阵按 float32 存储, 计算前升到 float64, 避免 float32 的舍入误差改变动量/量比的排名.
+    """
+    df_close = df_close.astype('float64', copy=False)
+    df_vol = df_vol.astype('float64', copy=False)
+    momentum = df_close.pct_change(momentum_window)
+    vol_ma = df_vol.rolling(window=vol_window).mean()
     vol_ratio = df_vol / (vol_ma + 1e-9)
-    
-    # 还原名称映射
-    code_name_map = df[['concept_code', 'concept_name']].drop_duplicates().set_index('concept_code')['concept_name'].to_dict()
 
-    # 准备写入的数据列表
-    batch_data = []
-    
-    # 获取有效日期列表 (从 START_DATE 开始)
-    valid_dates = momentum.index[momentum.index >= pd.Timestamp(START_DATE)]
-    
-    print(f"[3/4] iterating through {len(valid_dates)} days to map stocks...")
-    
-    for current_date in tqdm(valid_dates):
-        try:
-            # 提取当天的切片
-            day_mom = momentum.loc[current_date].dropna()
-            day_vol = vol_ratio.loc[current_date].dropna()
-            
-            common_idx = day_mom.index.intersection(day_vol.index)
-            if len(common_idx) == 0: continue
-            
-            # 截面排名
-            rank_mom = day_mom[common_idx].rank(pct=True)
-            rank_vol = day_vol[common_idx].rank(pct=True)
-            final_score = 0.7 * rank_mom + 0.3 * rank_vol
-            
-            # 取当天 Top K 板块
-            top_concepts = final_score.nlargest(TOP_K_CONCEPTS)
-            
-            # 将板块分映射给成分股
-            day_signals = []
-            for code, score in top_concepts.items():
-                c_name = code_name_map.get(code)
-                if not c_name: continue
-                
-                # 获取成分股 (优先查缓存)
-                stocks = get_stocks_in_concept_cached(c_name)
-                
-                for stock_code in stocks:
-                    day_signals.append({
-                        'ts_code': stock_code,
-                        'trade_date': current_date.date(),
-                        'alpha_score': score * ALPHA_SCALE,
-                        'strategy_name': 'sector_rotation_v1'
-                    })
-            
-            # 聚合去重 (如果一只股票同时属于两个Top板块，取最大分)
-            if day_signals:
-                df_day = pd.DataFrame(day_signals)
-                # 按股票去重取最大值
-                df_day_final = df_day.groupby(['ts_code', 'trade_date', 'strategy_name'])['alpha_score'].max().reset_index()
-                batch_data.append(df_day_final)
-                
-        except KeyError:
-            continue
-
-    if not batch_data:
+    valid = momentum.notna() & vol_ratio.notna()
+    rank_mom = momentum.where(valid).rank(axis=1, pct=True)
+    rank_vol = vol_ratio.where(valid).rank(axis=1, pct=True)
+    return mom_weight * rank_mom + vol_weight * rank_vol
+
+def compute_concept_scores(panel):
+    return score_concepts(*pivot_concept_history(panel))
+
+def select_top_concepts(scores, top_k=TOP_K_CONCEPTS):
+    """
+    每天取得分最高的 top_k 个板块, 返回长表 (trade_date, concept_code, score).
+    method='first' 的排名与逐日 nlargest(keep='first') 的并列处理一致.
+    """
+    order = scores.rank(axis=1, method='first', ascending=False)
+    top = scores.where(order <= top_k).stack().dropna()
+    top.index.names = ['trade_date', 'concept_code']
+    return top.rename('score').reset_index()
+
+def fan_out_to_stocks(top, code_name_map, intervals, strategy_name=STRATEGY_NAME):
+    """
+    把板块分映射给当天的成分股: 板块 x 成员区间 做一次 merge, 按日期过滤有效区间,
+    再按 (股票, 日期) 取最大分 (一只股票同时属于多个 Top 板块时取最高的那个).
+    """
+    top = top.assign(concept_name=top['concept_code'].map(code_name_map)).dropna(subset=['concept_name'])
+    pairs = top.merge(intervals, on='concept_name', how='inner')
+    pairs = pairs[(pairs['valid_from'] <= pairs['trade_date']) & (pairs['trade_date'] < pairs['valid_to'])]
+    if pairs.empty:
+        return pd.DataFrame(columns=ALPHA_COLUMNS)
+
+    signals = pairs.groupby(['ts_code', 'trade_date'], sort=False)['score'].max().reset_index()
+    signals['alpha_score'] = signals['score'] * ALPHA_SCALE
+    signals['trade_date'] = signals['trade_date'].dt.date
+    signals['strategy_name'] = strategy_name
+    return signals[ALPHA_COLUMNS]
+
+def main(incremental=False, server_side=False):
+    """
+    incremental=False: 从 START_DATE 全量重算;
+    incremental=True: 只读取最近一个滚动窗口的预热数据 + 新交易日, 只追加 sector_rotation_v1 最新日期之后的信号.
+    server_side=True: 因子和排名用 ClickHouse 窗口函数计算, 客户端只接收每天的 Top-K 板块.
+    """
+    last_date = get_last_signal_date() if incremental else None
+    if incremental and last_date is None:
+        print("No existing sector_rotation_v1 rows, falling back to full backfill.")
+
+    # 1. 确定读取范围 (增量模式只取预热窗口) 和需要输出信号的起始日期
+    if last_date is not None:
+        query_start = get_warmup_start(last_date)
+        score_start = last_date + pd.Timedelta(days=1)
+        print(f"Incremental mode: last signal date {last_date.date()}, warm-up from {query_start}")
+    else:
+        query_start = (datetime.strptime(START_DATE, "%Y-%m-%d") - timedelta(days=60)).strftime("%Y-%m-%d")
+        score_start = pd.Timestamp(START_DATE)
+    intervals = load_membership(since=query_start if last_date is not None else None)
+
+    if server_side:
+        # 动量/量比/截面排名/Top-K 全部在 ClickHouse 里算完, 只传回每天的 Top-K 板块
+        print(f"[1-2/4] Computing top {TOP_K_CONCEPTS} concepts in ClickHouse since {score_start.date()}...")
+        top = fetch_top_concepts_server_side(query_start, score_start)
+        code_name_map = dict(zip(top['concept_code'], top['concept_name']))
+        n_days = top['trade_date'].nunique()
+    else:
+        panel = fetch_all_concept_history(query_start)
+        if panel.empty: return
+
+        print("[2/4] Calculating historical scores...")
+        scores = compute_concept_scores(panel)
+        # 只保留 score_start 之后的日期 (之前的数据只用于计算初始 MA)
+        scores = scores[scores.index >= score_start]
+        # 还原名称映射
+        code_name_map = panel.label_map('concept_name')
+        n_days = len(scores)
+        top = select_top_concepts(scores) if n_days else None
+
+    if n_days == 0:
+        print("No new trading days since last run." if last_date is not None else "No concept scores computed.")
+        return
+
+    print(f"[3/4] Mapping top {TOP_K_CONCEPTS} concepts to stocks for {n_days} days...")
+    final_df = fan_out_to_stocks(top, code_name_map, intervals)
+
+    if final_df.empty:
         print("No signals generated.")
         return
 
-    print("[4/4] Merging and inserting into ClickHouse...")
-    final_df = pd.concat(batch_data, ignore_index=True)
+    print("[4/4] Inserting into ClickHouse...")
     
     # 写入数据库
-    client = get_client()
+    client = get_ch_client()
     
-    # 为了保证数据纯净, 先删除旧的历史数据 (保留表结构)
-    # 如果想保留之前的实盘记录, 可以只删除 START_DATE 之后的数据
-
-    ALLOW_DELETE = os.getenv("ALLOW_DELETE", "0") == "1"
-
-    if ALLOW_DELETE:
-        print(f"Deleting old sector_rotation_v1 data since {START_DATE}...")
-        client.execute(
-            f"ALTER TABLE stock_daily_alpha DELETE "
-            f"WHERE strategy_name = 'sector_rotation_v1' AND trade_date >= '{START_DATE}'"
-        )
-    else:
-        print("Skip DELETE. Set ALLOW_DELETE=1 to enable deletion.")
-    
-    #print(f"Deleting old sector_rotation_v1 data since {START_DATE}...")
-    #client.execute(f"ALTER TABLE stock_daily_alpha DELETE WHERE strategy_name = 'sector_rotation_v1' AND trade_date >= '{START_DATE}'")
+    # stock_daily_alpha 是 ReplacingMergeTree (见 infra/schema.py): 全量重算直接覆盖写入同一主键, 不需要先删除
     
-    # 分批写入防止超时
-    chunk_size = 50000
+    # 大块写入: 几十万行一个 part, 避免写入大量小 part
     total_rows = len(final_df)
     print(f"Inserting {total_rows} rows...")
     
-    for i in range(0, total_rows, chunk_size):
-        chunk = final_df.iloc[i:i+chunk_size]
-        client.insert_dataframe(
-            'INSERT INTO stock_daily_alpha (ts_code, trade_date, strategy_name, alpha_score) VALUES',
-            chunk[['ts_code', 'trade_date', 'strategy_name', 'alpha_score']]
-        )
-        print(f" Written {i + len(chunk)} / {total_rows}...")
+    with BufferedInserter(client, 'stock_daily_alpha', ALPHA_COLUMNS) as writer:
+        writer.add(final_df)
+    print(f" Written {writer.total_rows} rows in {writer.flush_count} insert(s).")
+    # 导出用的因子表只重算这次写入涉及的交易日
+    refresh_factors()
 
-    print("Historical Backfill Complete!")
+    print("Incremental Update Complete!" if last_date is not None else "Historical Backfill Complete!")
 
 if __name__ == "__main__":
-    main()
+    # 每日增量: python research/backfill_sector_rotation.py --incremental
+    # 服务端计算: python research/backfill_sector_rotation.py --server-side
+    main(
+        incremental="--incremental" in sys.argv[1:] or os.getenv("SECTOR_INCREMENTAL", "0") == "1",
+        server_side="--server-side" in sys.argv[1:] or os.getenv("SECTOR_SERVER_SIDE", "0") == "1",
+    )
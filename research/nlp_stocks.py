@@ -1,18 +1,17 @@
 import jieba
 import pandas as pd
-import pymongo
-from clickhouse_driver import Client
 import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.db import get_collection, query_dataframe
 
 # Path
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 DICT_PATH = os.path.join(CURRENT_DIR, "stock_dict.txt")
 
-# 2. DB connection
-mongo_client = pymongo.MongoClient("...")
-news_collection = mongo_client["stock_data"]["news_cailianshe"]
-
-ch_client = Client(host='...', user='...', password='...', database='stock_data', settings={'use_numpy': True})
+NEWS_COLLECTION = "news_cailianshe"
 
 
 def load_resources():
@@ -26,7 +25,7 @@ def load_resources():
     # 2. 从 ClickHouse 把“别名 -> 代码”的映射表取出来放在内存里
     # 格式: {'茅台': '600519', '贵州茅台': '600519', '宁王': '300750'...}
     print("正在读取代码映射表...")
-    df = ch_client.query_dataframe("SELECT alias, ts_code, name FROM stock_alias")
+    df = query_dataframe("SELECT alias, ts_code, name FROM stock_alias")
     
     # 转换成字典方便查询, 如果有重名（比如'平安'），这里简单处理取第一个。
     # 进阶的话需要结合上下文消歧 (Disambiguation)
@@ -45,7 +44,7 @@ BLACKLIST = {
 def analyze_stock_mentions(alias_map, name_map):
     print("\n正在扫描新闻中的个股...")
     
-    recent_news = list(news_collection.find().sort("crawled_at", -1).limit(50))
+    recent_news = list(get_collection(NEWS_COLLECTION).find().sort("crawled_at", -1).limit(50))
     stock_counter = {} 
     
     for news in recent_news:
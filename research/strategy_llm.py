@@ -1,17 +1,18 @@
 import pandas as pd
-import pymongo
-import akshare as ak
 import jieba
+import sys
 from datetime import datetime
-from clickhouse_driver import Client
-from nlp_stocks import load_resources, BLACKLIST
+from pathlib import Path
+from nlp_stocks import load_resources, BLACKLIST, NEWS_COLLECTION
 from llm_judge import analyze_news_impact
 
-# Connect to Database
-mongo_client = pymongo.MongoClient("...")
-news_collection = mongo_client["stock_data"]["news_cailianshe"]
-# ClickHouse Connection
-ch_client = Client(host='...', user='...', password='...', database='stock_data', settings={'use_numpy': True})
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.ch_writer import BufferedInserter
+from infra.spot_cache import get_spot_snapshot
+from infra.db import get_ch_client, get_collection
+from infra.factors import refresh_factors
+
+SENTIMENT_COLUMNS = ['ts_code', 'trade_date', 'publish_time', 'news_title', 'score', 'magnitude', 'certainty', 'reason']
 
 def get_market_caps(stock_codes):
     """
@@ -19,33 +20,20 @@ def get_market_caps(stock_codes):
     """
     print("正在查询最新市值数据...")
     try:
-        # 获取全市场实时行情
-        df = ak.stock_zh_a_spot_em()
+        # 全市场实时行情走共享快照缓存, 和 auto_trader 共用一次抓取
+        df = get_spot_snapshot()
         # 筛选出需要的股票
-        df = df[df['代码'].isin(stock_codes)]
+        df = df[df['ts_code'].isin(stock_codes)].dropna(subset=['total_mv'])
         
         # map: code -> market_cap (亿元)
-        # AKShare 返回的 '总市值' 单位是元，我们需要转成亿元方便 AI 理解
-        market_cap_map = {}
-        for _, row in df.iterrows():
-            code = row['代码']
-            # 总市值可能很大，转为“亿”为单位，保留2位小数
-            mkt_cap_yi = round(row['总市值'] / 100000000, 2)
-            market_cap_map[code] = mkt_cap_yi
-            
-        return market_cap_map
+        # 总市值单位是元，我们需要转成亿元方便 AI 理解, 保留2位小数
+        return dict(zip(df['ts_code'], (df['total_mv'] / 100000000).round(2)))
     except Exception as e:
         print(f"获取市值失败: {e}")
         return {}
     
-def save_results(results):
-    """
-    将分析结果批量写入 ClickHouse
-    """
-    if not results: return
-
-    print(f"正在将 {len(results)} 条因子数据存入 ClickHouse...")
-    
+def results_to_frame(results):
+    """把 AI 评分结果转换成 stock_news_sentiment 的行"""
     data_to_insert = []
     today = datetime.now().date()
     
@@ -63,14 +51,27 @@ def save_results(results):
         }
         data_to_insert.append(row)
     
-    # 转 DataFrame
-    df = pd.DataFrame(data_to_insert)
+    return pd.DataFrame(data_to_insert, columns=SENTIMENT_COLUMNS)
+
+def sentiment_writer():
+    return BufferedInserter(get_ch_client(), 'stock_news_sentiment', SENTIMENT_COLUMNS, max_rows=10000)
+
+def save_results(results, writer=None):
+    """
+    将分析结果写入 ClickHouse.
+    传入 writer 时只放进缓冲区, 由 writer 统一批量落盘 (进程退出时也会自动 flush)
+    """
+    if not results: return
+
+    df = results_to_frame(results)
     
     try:
-        ch_client.insert_dataframe(
-            'INSERT INTO stock_news_sentiment (ts_code, trade_date, publish_time, news_title, score, magnitude, certainty, reason) VALUES',
-            df
-        )
+        if writer is not None:
+            writer.add(df)
+            return
+        print(f"正在将 {len(results)} 条因子数据存入 ClickHouse...")
+        with sentiment_writer() as w:
+            w.add(df)
         print("因子入库成功！")
     except Exception as e:
         print(f"入库失败: {e}")
@@ -83,7 +84,7 @@ def run_ai_strategy():
 
     print("\n📰 1. 扫描最近新闻...")
     # 扫描最近 20 条用于测试
-    recent_news = list(news_collection.find().sort("crawled_at", -1).limit(20))
+    recent_news = list(get_collection(NEWS_COLLECTION).find().sort("crawled_at", -1).limit(20))
     stock_news_map = {} 
 
     # News time
@@ -130,32 +131,37 @@ def run_ai_strategy():
     
     results = []
 
-    # LLM
-    for code, items in stock_news_map.items():
-        name = name_map.get(code, "未知")
-        market_cap = market_cap_map.get(code, "未知")
-        
-        # 只分析最新的一条
-        latest_item = items[0] 
-        news_content = latest_item[0]
-        news_title = latest_item[1]
-        pub_time = latest_item[2]
-        
-        # 调用 AI
-        ai_result = analyze_news_impact(name, code, market_cap, news_content)
-        
-        results.append({
-            'code': code,
-            'name': name,
-            'publish_time': pub_time,
-            'title': news_title,
-            'score': ai_result['final_score'],
-            'magnitude': ai_result.get('magnitude', 0),
-            'certainty': ai_result.get('certainty', 0),
-            'reason': ai_result['reason']
-        })
-
-    save_results(results)
+    # LLM: 每条结果打分后立即进缓冲区, 中途异常退出时已评分的结果也会被 flush
+    with sentiment_writer() as writer:
+        for code, items in stock_news_map.items():
+            name = name_map.get(code, "未知")
+            market_cap = market_cap_map.get(code, "未知")
+            
+            # 只分析最新的一条
+            latest_item = items[0] 
+            news_content = latest_item[0]
+            news_title = latest_item[1]
+            pub_time = latest_item[2]
+            
+            # 调用 AI
+            ai_result = analyze_news_impact(name, code, market_cap, news_content)
+            
+            result = {
+                'code': code,
+                'name': name,
+                'publish_time': pub_time,
+                'title': news_title,
+                'score': ai_result['final_score'],
+                'magnitude': ai_result.get('magnitude', 0),
+                'certainty': ai_result.get('certainty', 0),
+                'reason': ai_result['reason']
+            }
+            results.append(result)
+            save_results([result], writer)
+
+        print(f"正在将 {len(results)} 条因子数据存入 ClickHouse...")
+    print(f"因子入库成功！共 {writer.total_rows} 条")
+    refresh_factors()
 
 if __name__ == "__main__":
     run_ai_strategy()
@@ -0,0 +1,174 @@
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent))
+from infra.ch_writer import BufferedInserter
+from infra.db import get_ch_client
+from infra.panel import VALUE_DTYPE
+from backfill_sector_rotation import (
+    START_DATE, ALPHA_COLUMNS, fetch_all_concept_history, load_membership, pivot_concept_history,
+    score_concepts, select_top_concepts, fan_out_to_stocks,
+)
+
+# 参数网格, 逗号分隔; 每个组合以独立的 strategy_name 写入 stock_daily_alpha
+SWEEP_MOMENTUM = os.getenv("SWEEP_MOMENTUM", "5,10,20")
+SWEEP_VOL = os.getenv("SWEEP_VOL", "10,20")
+SWEEP_TOPK = os.getenv("SWEEP_TOPK", "3,5,10")
+SWEEP_MOM_WEIGHT = os.getenv("SWEEP_MOM_WEIGHT", "0.5,0.7,0.9")
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# 设为 0 时只算汇总表, 不写库
+SWEEP_WRITE = os.getenv("SWEEP_WRITE", "1") == "1"
+SUMMARY_PATH = Path(os.getenv("SWEEP_SUMMARY", "research/sector_rotation_sweep.csv"))
+
+# worker 进程内的只读数据 (由 _init_worker 挂载共享内存)
+_shared = {}
+
+
+def variant_name(momentum_window, vol_window, top_k, mom_weight):
+    return f"sector_rotation_m{momentum_window}_v{vol_window}_k{top_k}_w{int(round(mom_weight * 100))}"
+
+
+def parameter_grid():
+    def parse(spec, cast):
+        return [cast(x) for x in spec.split(",") if x.strip()]
+    return list(itertools.product(
+        parse(SWEEP_MOMENTUM, int), parse(SWEEP_VOL, int), parse(SWEEP_TOPK, int), parse(SWEEP_MOM_WEIGHT, float)
+    ))
+
+
+def _to_shared(frame):
+    """把 float32 矩阵拷进共享内存, 返回 (SharedMemory, 描述信息); 子进程按名字挂载, 不再复制"""
+    values = np.ascontiguousarray(frame.to_numpy(dtype=VALUE_DTYPE))
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+    return shm, (shm.name, values.shape)
+
+
+def _init_worker(close_spec, vol_spec, index, columns, code_name_map, intervals):
+    for key, (name, shape) in (('close', close_spec), ('vol', vol_spec)):
+        shm = shared_memory.SharedMemory(name=name)
+        arr = np.ndarray(shape, dtype=VALUE_DTYPE, buffer=shm.buf)
+        arr.flags.writeable = False
+        _shared[f'{key}_shm'] = shm
+        _shared[key] = pd.DataFrame(arr, index=index, columns=columns, copy=False)
+    _shared['code_name_map'] = code_name_map
+    _shared['intervals'] = intervals
+
+
+def summarize(scores, top, signals, df_close):
+    """
+    变体的精简评估: Top-K 板块次日等权收益的均值/波动/年化 IR/胜率, Top-K 换手率, 日均覆盖股票数.
+    只用板块收盘价, 不需要导出到 Qlib.
+    """
+    next_ret = df_close.pct_change(fill_method=None).shift(-1)
+    mask = pd.DataFrame(False, index=scores.index, columns=scores.columns)
+    if not top.empty:
+        picked = top.pivot(index='trade_date', columns='concept_code', values='score').notna()
+        mask.loc[picked.index, picked.columns] = picked
+    daily = next_ret.reindex(index=mask.index, columns=mask.columns).where(mask).mean(axis=1).dropna()
+
+    held = mask.astype(int)
+    turnover = (held.diff().abs().sum(axis=1) / (2 * held.sum(axis=1).clip(lower=1))).iloc[1:].mean()
+    std = daily.std()
+    return {
+        'days': int(len(daily)),
+        'mean_next_ret': float(daily.mean()) if len(daily) else np.nan,
+        'std_next_ret': float(std) if len(daily) > 1 else np.nan,
+        'ir': float(daily.mean() / std * np.sqrt(252)) if len(daily) > 1 and std > 0 else np.nan,
+        'hit_rate': float((daily > 0).mean()) if len(daily) else np.nan,
+        'turnover': float(turnover) if len(held) > 1 else np.nan,
+        'stocks_per_day': float(signals.groupby('trade_date').size().mean()) if not signals.empty else 0.0,
+        'rows': int(len(signals)),
+    }
+
+
+def run_variant(params, write=SWEEP_WRITE):
+    momentum_window, vol_window, top_k, mom_weight = params
+    name = variant_name(*params)
+    started = time.monotonic()
+
+    # 共享内存里是只读的 float32 矩阵, 每个变体在自己的 float64 副本上计算
+    df_close, df_vol = _shared['close'].astype('float64'), _shared['vol'].astype('float64')
+    scores = score_concepts(df_close, df_vol, momentum_window, vol_window,
+                            mom_weight=mom_weight, vol_weight=round(1 - mom_weight, 10))
+    scores = scores[scores.index >= pd.Timestamp(START_DATE)]
+    top = select_top_concepts(scores, top_k)
+    signals = fan_out_to_stocks(top, _shared['code_name_map'], _shared['intervals'], strategy_name=name)
+
+    if write and not signals.empty:
+        # 每个 worker 进程有自己的 ClickHouse 连接
+        with BufferedInserter(get_ch_client(), 'stock_daily_alpha', ALPHA_COLUMNS) as writer:
+            writer.add(signals)
+
+    row = {'strategy_name': name, 'momentum_window': momentum_window, 'vol_window': vol_window,
+           'top_k': top_k, 'mom_weight': mom_weight}
+    row.update(summarize(scores, top, signals, df_close))
+    row['seconds'] = round(time.monotonic() - started, 2)
+    return row
+
+
+def run_sweep(grid=None, workers=SWEEP_WORKERS, write=SWEEP_WRITE):
+    """
+    历史数据只读取/pivot 一次, 放进共享内存后由进程池并行评估每个参数组合.
+    返回按 IR 排序的汇总表, 同时写到 SUMMARY_PATH.
+    """
+    grid = grid or parameter_grid()
+    max_window = max(max(m, v) for m, v, _, _ in grid)
+    panel = fetch_all_concept_history(
+        (pd.Timestamp(START_DATE) - pd.Timedelta(days=max(60, max_window * 3))).strftime("%Y-%m-%d")
+    )
+    if panel.empty:
+        return pd.DataFrame()
+    df_close, df_vol = pivot_concept_history(panel)
+    code_name_map = panel.label_map('concept_name')
+    intervals = load_membership()
+    del panel
+
+    close_shm, close_spec = _to_shared(df_close)
+    vol_shm, vol_spec = _to_shared(df_vol)
+    rows = []
+    print(f"Sweeping {len(grid)} variants on {df_close.shape[0]} days x {df_close.shape[1]} concepts "
+          f"with {workers} workers (write={write})...")
+    try:
+        # spawn: 子进程不继承父进程已建立的数据库连接
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=mp.get_context('spawn'), initializer=_init_worker,
+            initargs=(close_spec, vol_spec, df_close.index, df_close.columns, code_name_map, intervals),
+        ) as executor:
+            futures = {executor.submit(run_variant, params, write): params for params in grid}
+            for future in as_completed(futures):
+                params = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    print(f"  {variant_name(*params)} failed: {e}")
+                    continue
+                rows.append(row)
+                print(f"  {row['strategy_name']}: IR {row['ir']:.2f}, {row['rows']} rows, {row['seconds']}s")
+    finally:
+        for shm in (close_shm, vol_shm):
+            shm.close()
+            shm.unlink()
+
+    summary = pd.DataFrame(rows)
+    if not summary.empty:
+        summary = summary.sort_values('ir', ascending=False).reset_index(drop=True)
+        SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        summary.to_csv(SUMMARY_PATH, index=False)
+        print(f"Summary saved to {SUMMARY_PATH}")
+        print(summary.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+    return summary
+
+
+if __name__ == "__main__":
+    run_sweep()
@@ -1,10 +1,14 @@
 import pandas as pd
 import json
 import os
-import akshare as ak
+import sys
 from datetime import datetime
+from pathlib import Path
 import math
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from infra.spot_cache import get_spot_snapshot
+
 # Config
 POSITION_FILE = "trade/positions.json" # 持仓存档文件
 SCORE_FILE = "trade/daily_scores.csv" # AI预测结果文件
@@ -33,52 +37,29 @@ def get_market_snapshot():
     """
     获取全市场实时行情 (含换手、振幅、量比)
     """
-    print("正在从 AkShare 获取全市场实时行情 (SnapShot)...")
+    print("正在获取全市场实时行情 (SnapShot, 走本地缓存)...")
     try:
-        df = ak.stock_zh_a_spot_em()
-        
-        col_map = {
-            '代码': 'code', 'symbol': 'code',
-            '最新价': 'price', 'trade': 'price',
-            '涨跌幅': 'pct_chg', 'changepct': 'pct_chg',
-            '名称': 'name', 'name': 'name',
-            '换手率': 'turnover', 'turnoverratio': 'turnover',
-            '振幅': 'amplitude', 'amplitude': 'amplitude',
-            '量比': 'volume_ratio', 'volumeratio': 'volume_ratio'
-        }
-        df = df.rename(columns=col_map)
-        
-        if 'code' not in df.columns or 'price' not in df.columns:
-            print("数据列名异常")
-            return {}
+        df = get_spot_snapshot()
+
+        # 价格无效 (停牌/未开盘) 的股票直接丢弃, 因子缺失按 0 处理
+        df = df[df['price'] > 0].copy()
+        factor_cols = ['pct_chg', 'turnover_rate', 'amplitude', 'volume_ratio']
+        df[factor_cols] = df[factor_cols].fillna(0.0)
 
-        df['code'] = df['code'].astype(str).str.zfill(6)
-        
         market_map = {}
-        for _, row in df.iterrows():
-            try:
-                raw_price = row['price']
-                if raw_price in ['-', '', None]: continue
-                price = float(raw_price)
-                if math.isnan(price) or price <= 0: continue
-                
-                # 提取因子数据
-                pct = float(row.get('pct_chg', 0)) if not math.isnan(float(row.get('pct_chg', 0))) else 0.0
-                turnover = float(row.get('turnover', 0)) if not math.isnan(float(row.get('turnover', 0))) else 0.0
-                amplitude = float(row.get('amplitude', 0)) if not math.isnan(float(row.get('amplitude', 0))) else 0.0
-                vol_ratio = float(row.get('volume_ratio', 0)) if not math.isnan(float(row.get('volume_ratio', 0))) else 0.0
-                
-                market_map[row['code']] = {
-                    'price': price, 
-                    'pct_chg': pct, 
-                    'name': str(row.get('name', 'Unknown')),
-                    # 因子包
-                    'turnover': turnover,
-                    'amplitude': amplitude,
-                    'volume_ratio': vol_ratio
-                }
-            except:
-                continue
+        for code, price, pct, name, turnover, amplitude, vol_ratio in zip(
+            df['ts_code'], df['price'], df['pct_chg'], df['name'],
+            df['turnover_rate'], df['amplitude'], df['volume_ratio']
+        ):
+            market_map[code] = {
+                'price': float(price), 
+                'pct_chg': float(pct), 
+                'name': name or 'Unknown',
+                # 因子包
+                'turnover': float(turnover),
+                'amplitude': float(amplitude),
+                'volume_ratio': float(vol_ratio)
+            }
         print(f"行情获取成功, 包含 {len(market_map)} 只有效股票数据")
         return market_map
     except Exception as e: